@@ -0,0 +1,88 @@
+"""
+Recall and latency of the ANN index modes (utils/ann_index.py) against the exact flat index.
+
+Run from the bot directory:
+    python benchmarks/ann_recall.py --docs 50000 --dim 2048
+    python benchmarks/ann_recall.py --vectors data/vector_stores/general/shards/000001/snapshot-3/vectors.f32 --dim 2048
+
+--vectors benchmarks on a real shard's flat export (written at every compaction); queries are
+then sampled from the shard itself with a little noise added.
+"""
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.ann_index import build_ann_index, set_search_params, target_nlist
+
+def clustered_vectors(count: int, dim: int, clusters: int, rng) -> np.ndarray:
+    """Gaussian blobs, closer to real embeddings than uniform noise."""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, count)
+    return centers[labels] + 0.3 * rng.standard_normal((count, dim)).astype(np.float32)
+
+def recall_at_k(found: np.ndarray, expected: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found, expected))
+    return hits / expected.size
+
+def timed_search(index, queries: np.ndarray, k: int) -> tuple[np.ndarray, float]:
+    """Searches one query at a time, like the app does. Returns ids and mean latency in ms."""
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    started = time.perf_counter()
+    for i, query in enumerate(queries):
+        _, ids[i] = index.search(query[None, :], k)
+    return ids, (time.perf_counter() - started) * 1000 / len(queries)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--vectors", help="flat float32 vectors file (vectors.f32 of a store snapshot)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.vectors:
+        vectors = np.fromfile(args.vectors, dtype=np.float32).reshape(-1, args.dim)
+        sample = vectors[rng.integers(0, len(vectors), args.queries)]
+        queries = sample + 0.01 * rng.standard_normal(sample.shape).astype(np.float32)
+    else:
+        clusters = max(1, args.docs // 100)
+        vectors = clustered_vectors(args.docs, args.dim, clusters, rng)
+        queries = clustered_vectors(args.queries, args.dim, clusters, rng)
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, {len(queries)} queries, k={args.k}\n")
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    expected, exact_ms = timed_search(exact, queries, args.k)
+    print(f"{'index':<28}{'build s':>10}{f'recall@{args.k}':>12}{'ms/query':>12}")
+    print(f"{'flat (exact)':<28}{'-':>10}{1.0:>12.3f}{exact_ms:>12.3f}")
+
+    for index_type, knob, values in (("ivf", "nprobe", args.nprobe), ("hnsw", "efSearch", args.ef_search)):
+        started = time.perf_counter()
+        index = build_ann_index(vectors, index_type)
+        build_seconds = time.perf_counter() - started
+        if index_type == "ivf":
+            values = [v for v in values if v <= index.nlist]
+            label = f"ivf nlist={index.nlist}"
+        else:
+            label = "hnsw"
+        for value in values:
+            if index_type == "ivf":
+                set_search_params(index, nprobe=value)
+            else:
+                set_search_params(index, ef_search=value)
+            found, ms = timed_search(index, queries, args.k)
+            print(f"{f'{label} {knob}={value}':<28}{build_seconds:>10.2f}{recall_at_k(found, expected):>12.3f}{ms:>12.3f}")
+
+    print(f"\nDefault nlist for this size: {target_nlist(len(vectors))}")
+
+if __name__ == "__main__":
+    main()
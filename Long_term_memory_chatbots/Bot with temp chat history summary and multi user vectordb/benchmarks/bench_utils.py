@@ -0,0 +1,16 @@
+import statistics
+
+def percentiles(values: list) -> dict:
+    """p50/p95/p99/max of values (seconds), or an empty dict when there are none."""
+    if not values:
+        return {}
+    if len(values) == 1:
+        return {"p50": values[0], "p95": values[0], "p99": values[0], "max": values[0]}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98], "max": max(values)}
+
+def format_percentiles(values: list) -> str:
+    result = percentiles(values)
+    if not result:
+        return "n/a"
+    return " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in result.items())
@@ -0,0 +1,74 @@
+"""
+Concurrent load test of the chat service (chat_service.py) over HTTP.
+
+Each simulated user sends --turns questions one after another; --users of them run at once.
+Reports throughput and latency percentiles; with --stream also the time to the first chunk.
+
+    python benchmarks/stub_ollama.py --port 11435 &
+    OLLAMA_HOST=http://127.0.0.1:11435 python chat_service.py &
+    python benchmarks/load_test.py --users 50 --turns 5 --stream
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from bench_utils import format_percentiles
+
+async def ask(client: httpx.AsyncClient, url: str, user_id: str, question: str, stream: bool, stats: dict):
+    body = {"user_id": user_id, "question": question}
+    started = time.perf_counter()
+    try:
+        if not stream:
+            response = await client.post(f"{url}/chat", json=body)
+            response.raise_for_status()
+        else:
+            first_chunk = None
+            async with client.stream("POST", f"{url}/chat/stream", json=body) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line.startswith("event: error"):
+                        raise RuntimeError("stream ended with an error event")
+                    if first_chunk is None and line.startswith("data:") and "chunk" in json.loads(line[5:]):
+                        first_chunk = time.perf_counter() - started
+            stats["first_chunk"].append(first_chunk if first_chunk is not None else time.perf_counter() - started)
+        stats["latency"].append(time.perf_counter() - started)
+    except Exception as e:
+        stats["errors"].append(repr(e))
+
+async def simulate_user(client, url: str, user_id: str, turns: int, stream: bool, stats: dict):
+    for turn in range(turns):
+        await ask(client, url, user_id, f"Question {turn} from {user_id}: what did we talk about before?", stream, stats)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--stream", action="store_true", help="use the server-sent events endpoint")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    stats = {"latency": [], "first_chunk": [], "errors": []}
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            simulate_user(client, args.url, f"loadtest-user-{i}", args.turns, args.stream, stats)
+            for i in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started
+        server_metrics = (await client.get(f"{args.url}/metrics")).json()
+
+    print(f"{args.users} users x {args.turns} turns in {elapsed:.1f}s: {len(stats['latency']) / elapsed:.2f} answers/s, {len(stats['errors'])} errors")
+    print(f"latency      {format_percentiles(stats['latency'])}")
+    if args.stream:
+        print(f"first chunk  {format_percentiles(stats['first_chunk'])}")
+    for error in stats["errors"][:5]:
+        print(f"error: {error}")
+    print(json.dumps(server_metrics, indent=2))
+
+if __name__ == "__main__":
+    asyncio.run(main())
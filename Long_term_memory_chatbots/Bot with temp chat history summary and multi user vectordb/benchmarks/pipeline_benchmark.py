@@ -0,0 +1,263 @@
+"""
+End-to-end benchmark of the turn pipeline: N users x M turns, run in rounds (turn m of every user,
+then turn m + 1, ...) on a thread pool, each user's turns in order.
+
+Every turn goes through chat_pipeline.generate_response_stream, as in the apps: concurrent retrieval,
+prompt assembly and generation in the foreground, then the memory update on the persistent job queue
+(coalesced per user, the knowledge store written by its single writer). Per-stage timings come from the
+tracing spans (utils/tracing.py, exported to JSONL): spans tagged with a turn id are foreground work,
+the rest (memory.update and everything it calls) ran on the job workers.
+After every round it waits for the background work to finish, then reports throughput, SQLite row
+counts and vector store sizes, so slowdowns as the stores grow show up; at the end, p50/p95/p99 per stage.
+
+Runs offline by default (LLM_BACKEND=fake, EMBEDDING_BACKEND=hash, TOKENIZER=approx, see readme.txt)
+in a fresh working directory; set those variables yourself (e.g. LLM_BACKEND=ollama) for a real model.
+
+    python benchmarks/pipeline_benchmark.py --users 50 --turns 20 --concurrency 8
+    python benchmarks/pipeline_benchmark.py --users 50 --turns 20 --json results.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_utils import percentiles, format_percentiles
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS = ["my dog Rex", "the trip to Lisbon", "learning the piano", "my sister's wedding",
+          "the new job at the bakery", "training for a marathon", "the garden tomatoes", "a chess opening"]
+
+def set_benchmark_defaults():
+    """Offline backends and throwaway paths, unless the caller already set them."""
+    for name, value in {
+        "OLLAMA_MODEL": "llama3.2:1b",
+        "VECTORDB_PATH": "data/vector_stores/",
+        "TEMP_MEMORY_DB_NAME": "benchmark_memory.db",
+        "SAVED_CHAT_CONVO": "5",
+        "SAVED_CHAT_SUMMARIES": "10",
+        "LLM_BACKEND": "fake",
+        "EMBEDDING_BACKEND": "hash",
+        "TOKENIZER": "approx",
+        "FAKE_LLM_FIRST_TOKEN_MS": "20",
+        "FAKE_LLM_TOKENS_PER_SECOND": "1000",
+        # Rounds are separated by a drain, so a long quiet period would only add idle time
+        "MEMORY_UPDATE_QUIET_SECONDS": "0.2",
+        "JOB_POLL_INTERVAL_SECONDS": "0.05",
+        "LOG_VERBOSE": "false",
+    }.items():
+        os.environ.setdefault(name, value)
+    # Stage timings are read back from the span log
+    os.environ["TRACE_EXPORTER"] = "jsonl"
+    os.environ["TRACE_FILE"] = "data/traces.jsonl"
+
+def question_for(user_index: int, turn: int) -> str:
+    topic = TOPICS[(user_index + turn) % len(TOPICS)]
+    return f"Turn {turn}: can you remind me what I told you about {topic}, and what I should do next?"
+
+def stage_name(record: dict) -> str:
+    """Span name, qualified by the table or store it touched (db.fetch[chat_history], vector.search[user])."""
+    detail = record.get("table") or record.get("store")
+    return f"{record['span']}[{detail}]" if detail else record["span"]
+
+class SpanReader:
+    """Reads the span records appended to TRACE_FILE since the last call."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+
+    def read(self) -> list:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            f.seek(self.offset)
+            lines = f.readlines()
+            self.offset = f.tell()
+        return [json.loads(line) for line in lines if line.strip()]
+
+def wait_for_background_work(pipeline):
+    """Blocks until every memory update job has run and the knowledge store writer is idle."""
+    while True:
+        metrics = pipeline.get_job_queue_metrics()
+        if metrics["pending"] == 0 and metrics["running"] == 0:
+            break
+        time.sleep(0.01)
+    pipeline.drain_general_writer()
+
+def directory_mb(path: str) -> float:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / (1024 * 1024)
+
+def vector_count(pipeline, path: str) -> int:
+    """
+    Vectors in a store, counted from its files: loading it would warm the store cache and evict
+    the stores the next round would otherwise find there.
+    """
+    if pipeline.numpy_store_exists(path):
+        return len(pipeline.np.load(os.path.join(path, "vectors.npy"), mmap_mode="r"))
+
+    # FAISS layout (utils/faiss_persistence.py): the live snapshot plus the entries logged since
+    generation = pipeline.read_generation(path)
+    snapshot_path = pipeline.get_snapshot_path(path, generation)
+    count = 0
+    if os.path.exists(os.path.join(snapshot_path, "offsets.u64")):
+        count = os.path.getsize(os.path.join(snapshot_path, "offsets.u64")) // 8 - 1
+    elif os.path.exists(os.path.join(snapshot_path, "index.faiss")):
+        count = pipeline.faiss.read_index(os.path.join(snapshot_path, "index.faiss")).ntotal
+    _, docstore_path = pipeline.get_log_paths(path, generation)
+    return count + len(pipeline.read_log_lines(docstore_path)[0])
+
+def store_sizes(pipeline) -> dict:
+    """SQLite row counts and vector store sizes, after pending vector writes are on disk."""
+    pipeline.flush_vector_stores()
+    with pipeline.get_connection() as conn:
+        rows = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("chat_history", "chat_summary")}
+
+    vectordb_path = os.environ["VECTORDB_PATH"]
+    user_dir = os.path.join(vectordb_path, "user")
+    user_ids = set(os.listdir(user_dir)) if os.path.isdir(user_dir) else set()
+    user_vectors = sum(vector_count(pipeline, pipeline.get_store_path(user_id)) for user_id in user_ids)
+    if pipeline.USER_VECTOR_BACKEND == "tenant":
+        tenant_index = pipeline.get_tenant_index(os.path.join(vectordb_path, "tenants"))
+        user_ids |= set(tenant_index.postings)
+        user_vectors += tenant_index.count
+    general_vectors = sum(vector_count(pipeline, path) for path in pipeline.get_general_shard_paths())
+    return {
+        "chat_history_rows": rows["chat_history"],
+        "chat_summary_rows": rows["chat_summary"],
+        "user_stores": len(user_ids),
+        "user_vectors": user_vectors,
+        "user_stores_mb": directory_mb(user_dir) + directory_mb(os.path.join(vectordb_path, "tenants")),
+        "general_vectors": general_vectors,
+        "general_mb": directory_mb(os.path.join(vectordb_path, "general")),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--workdir", help="working directory for data/ (default: a new temporary directory)")
+    parser.add_argument("--json", help="write per-round and per-stage results to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's VERBOSE output")
+    args = parser.parse_args()
+
+    if args.verbose:
+        os.environ["LOG_VERBOSE"] = "true"
+    set_benchmark_defaults()
+    json_path = os.path.abspath(args.json) if args.json else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="memory-bot-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    sys.path.insert(0, BOT_DIR)
+
+    # Imported after the environment and working directory are set, as the modules read both on import
+    import types
+    import faiss
+    import numpy as np
+    from utils.sql_manager import init_db, get_connection
+    from utils.job_queue import start_job_workers, get_job_queue_metrics
+    from utils.chat_pipeline import generate_response_stream
+    from utils.tracing import flush_traces, TRACE_FILE
+    from utils.numpy_store import numpy_store_exists
+    from utils.faiss_persistence import read_generation, get_snapshot_path, get_log_paths, read_log_lines
+    from utils.tenant_index import get_tenant_index
+    from utils.vectorstore_manager import (drain_general_writer, flush_vector_stores, get_general_shard_paths,
+                                           get_store_path, USER_VECTOR_BACKEND)
+    pipeline = types.SimpleNamespace(
+        faiss=faiss, np=np,
+        get_connection=get_connection, get_job_queue_metrics=get_job_queue_metrics,
+        drain_general_writer=drain_general_writer, flush_vector_stores=flush_vector_stores,
+        get_general_shard_paths=get_general_shard_paths, get_store_path=get_store_path,
+        numpy_store_exists=numpy_store_exists, read_generation=read_generation,
+        get_snapshot_path=get_snapshot_path, get_log_paths=get_log_paths, read_log_lines=read_log_lines,
+        get_tenant_index=get_tenant_index, USER_VECTOR_BACKEND=USER_VECTOR_BACKEND
+    )
+
+    print(f"{args.users} users x {args.turns} turns, concurrency {args.concurrency}, "
+          f"LLM_BACKEND={os.environ['LLM_BACKEND']}, EMBEDDING_BACKEND={os.environ['EMBEDDING_BACKEND']}, "
+          f"USER_VECTOR_BACKEND={USER_VECTOR_BACKEND}, workdir {workdir}\n")
+    print(f"{'round':>5}{'turns/s':>9}{'p95 turn':>10}{'drain':>8}{'history':>9}{'summary':>9}{'users':>7}"
+          f"{'user vec':>10}{'user MB':>9}{'general':>9}{'gen MB':>8}")
+
+    def run_turn(user_index, turn):
+        # Drains the stream like the apps do; the turn is saved and its memory update queued at the end
+        for _ in generate_response_stream(question_for(user_index, turn), f"bench-user-{user_index}"):
+            pass
+
+    foreground = defaultdict(list)
+    background = defaultdict(list)
+    drains = []
+    rounds = []
+    spans = SpanReader(TRACE_FILE)
+    started = time.perf_counter()
+    init_db()
+    start_job_workers()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for turn in range(args.turns):
+            round_started = time.perf_counter()
+            list(executor.map(lambda user_index: run_turn(user_index, turn), range(args.users)))
+            round_seconds = time.perf_counter() - round_started
+
+            # Not part of the round: the memory updates it queued, run by the job workers
+            drain_started = time.perf_counter()
+            wait_for_background_work(pipeline)
+            drains.append(time.perf_counter() - drain_started)
+            flush_traces()
+            turn_seconds = []
+            for record in spans.read():
+                stages = foreground if record.get("turn_id") else background
+                stages[stage_name(record)].append(record["duration_ms"] / 1000)
+                if record["span"] == "turn":
+                    turn_seconds.append(record["duration_ms"] / 1000)
+
+            sizes = store_sizes(pipeline)
+            rounds.append({
+                "round": turn + 1,
+                "seconds": round_seconds,
+                "turns_per_second": args.users / round_seconds,
+                "background_drain_seconds": drains[-1],
+                "turn": percentiles(turn_seconds),
+                **sizes,
+            })
+            print(f"{turn + 1:>5}{args.users / round_seconds:>9.1f}"
+                  f"{rounds[-1]['turn'].get('p95', 0) * 1000:>8.0f}ms{drains[-1]:>7.1f}s"
+                  f"{sizes['chat_history_rows']:>9}{sizes['chat_summary_rows']:>9}{sizes['user_stores']:>7}"
+                  f"{sizes['user_vectors']:>10}{sizes['user_stores_mb']:>9.2f}{sizes['general_vectors']:>9}"
+                  f"{sizes['general_mb']:>8.2f}")
+    elapsed = sum(round_result["seconds"] for round_result in rounds)
+
+    total_turns = args.users * args.turns
+    print(f"\n{total_turns} turns in {elapsed:.1f}s: {total_turns / elapsed:.2f} turns/s with memory updates "
+          f"on the job workers ({time.perf_counter() - started:.1f}s wall time including the drain after every round)")
+    print("\nForeground (per turn)")
+    for name in sorted(foreground):
+        print(f"  {name:<26}{format_percentiles(foreground[name])}")
+    print("Background (job workers)")
+    for name in sorted(background):
+        print(f"  {name:<26}{format_percentiles(background[name])}")
+    print(f"  {'drain after round':<26}{format_percentiles(drains)}")
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({
+                "users": args.users,
+                "turns": args.turns,
+                "concurrency": args.concurrency,
+                "turns_per_second": total_turns / elapsed,
+                "foreground_stages": {name: percentiles(values) for name, values in foreground.items()},
+                "background_stages": {name: percentiles(values) for name, values in background.items()},
+                "rounds": rounds,
+            }, f, indent=2)
+        print(f"\nResults written to {json_path}")
+
+if __name__ == "__main__":
+    main()
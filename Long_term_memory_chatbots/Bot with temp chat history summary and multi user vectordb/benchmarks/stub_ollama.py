@@ -0,0 +1,68 @@
+"""
+Minimal stand-in for the ollama HTTP API (/api/chat and /api/embed) so the chat service can be
+load-tested over real HTTP without a GPU. Replies and embeddings come from utils/fake_backends.py
+(the in-process LLM_BACKEND=fake / EMBEDDING_BACKEND=hash stand-ins); latency is configurable.
+
+Run from the bot directory, then point the app at it:
+    python benchmarks/stub_ollama.py --port 11435 --first-token-ms 200 --tokens-per-second 50
+    OLLAMA_HOST=http://127.0.0.1:11435 python chat_service.py
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.fake_backends import fake_reply_tokens, HashEmbeddings
+
+args = None
+
+async def chat(request):
+    body = await request.json()
+    words = fake_reply_tokens(body.get("messages", []), body.get("format"))
+    model = body.get("model", "stub")
+
+    def message(content: str, done: bool) -> dict:
+        return {"model": model, "message": {"role": "assistant", "content": content}, "done": done}
+
+    if not body.get("stream", True):
+        await asyncio.sleep((args.first_token_ms + 1000 * len(words) / args.tokens_per_second) / 1000)
+        return JSONResponse(message("".join(words), True))
+
+    async def lines():
+        await asyncio.sleep(args.first_token_ms / 1000)
+        for word in words:
+            yield json.dumps(message(word, False)) + "\n"
+            await asyncio.sleep(1 / args.tokens_per_second)
+        yield json.dumps(message("", True)) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+async def embed(request):
+    body = await request.json()
+    texts = body.get("input", [])
+    texts = [texts] if isinstance(texts, str) else texts
+    await asyncio.sleep(args.embed_ms / 1000)
+    return JSONResponse({"model": body.get("model", "stub"), "embeddings": HashEmbeddings(args.dim).embed_documents(texts)})
+
+app = Starlette(routes=[
+    Route("/api/chat", chat, methods=["POST"]),
+    Route("/api/embed", embed, methods=["POST"]),
+])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--first-token-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--embed-ms", type=float, default=20)
+    parser.add_argument("--dim", type=int, default=384)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
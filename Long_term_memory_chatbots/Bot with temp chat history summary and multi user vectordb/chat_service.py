@@ -0,0 +1,112 @@
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.routing import Route
+import uvicorn
+
+from utils.sql_manager import init_db
+from utils.job_queue import start_job_workers, get_job_queue_metrics
+from utils.chat_pipeline import agenerate_response, agenerate_response_stream
+from utils.llm_client import get_llm_metrics
+from utils.vectorstore_manager import ollama_embeddings, drain_general_writer, flush_vector_stores
+from utils.tracing import verbose, get_trace_metrics, get_prometheus_metrics
+
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+load_dotenv()
+
+# Configuration
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", 8000))
+
+# Headless chat service: the same pipeline as streamlit_userchat.py behind an ASGI app.
+#
+# POST /chat          {"user_id": "...", "question": "..."} -> {"user_id": "...", "response": "..."}
+# POST /chat/stream   same body, answered as server-sent events: one "data: {"chunk": "..."}" per chunk,
+#                     then "event: done" (or "event: error" if the answer failed midway)
+# GET  /health        liveness check
+# GET  /metrics       job queue, LLM slot, embedding cache and per-stage tracing counters
+# GET  /metrics/prometheus   the same tracing counters in the Prometheus text format
+#
+# Run a single process (python chat_service.py); it owns the background job workers of the database.
+
+@asynccontextmanager
+async def lifespan(app):
+    # Module-level resources (embeddings, DB pool, index cache) are created on import; this runs once per process
+    init_db()
+    start_job_workers()
+    verbose(f"Chat service ready on {SERVICE_HOST}:{SERVICE_PORT}")
+    yield
+    drain_general_writer()
+    flush_vector_stores()
+
+async def _read_chat_request(request):
+    """Returns (user_id, question) from the JSON body, or a 400 response."""
+    try:
+        body = await request.json()
+    except ValueError:
+        return None, JSONResponse({"error": "Body must be JSON"}, status_code=400)
+    user_id = body.get("user_id") if isinstance(body, dict) else None
+    question = body.get("question") if isinstance(body, dict) else None
+    if not isinstance(user_id, str) or not user_id.strip() or not isinstance(question, str) or not question.strip():
+        return None, JSONResponse({"error": "'user_id' and 'question' must be non-empty strings"}, status_code=400)
+    return (user_id.strip(), question), None
+
+async def chat(request):
+    chat_request, error = await _read_chat_request(request)
+    if error:
+        return error
+    user_id, question = chat_request
+    response = await agenerate_response(question, user_id)
+    return JSONResponse({"user_id": user_id, "response": response})
+
+def _sse(data: dict, event: str | None = None) -> str:
+    return (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
+
+async def chat_stream(request):
+    chat_request, error = await _read_chat_request(request)
+    if error:
+        return error
+    user_id, question = chat_request
+
+    async def events():
+        try:
+            async for chunk in agenerate_response_stream(question, user_id):
+                yield _sse({"chunk": chunk})
+        except Exception as e:
+            verbose(f"⚠️ Streaming response for user {user_id} failed: {e}")
+            yield _sse({"error": str(e)}, event="error")
+            return
+        yield _sse({}, event="done")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+async def health(request):
+    return JSONResponse({"status": "ok"})
+
+async def metrics(request):
+    return JSONResponse({
+        "job_queue": await asyncio.to_thread(get_job_queue_metrics),
+        "llm": get_llm_metrics(),
+        "embedding_cache": ollama_embeddings.get_cache_stats(),
+        "tracing": get_trace_metrics(),
+    })
+
+async def prometheus_metrics(request):
+    return PlainTextResponse(get_prometheus_metrics(), media_type="text/plain; version=0.0.4")
+
+app = Starlette(
+    routes=[
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Route("/health", health, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/metrics/prometheus", prometheus_metrics, methods=["GET"]),
+    ],
+    lifespan=lifespan
+)
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=SERVICE_HOST, port=SERVICE_PORT)
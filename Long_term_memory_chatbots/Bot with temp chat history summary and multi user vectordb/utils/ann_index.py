@@ -0,0 +1,69 @@
+import faiss
+import numpy as np
+
+import os
+import math
+from dotenv import load_dotenv
+load_dotenv()
+
+# Configuration
+GENERAL_INDEX_TYPE = os.getenv("GENERAL_INDEX_TYPE", "flat")  # "flat", "ivf" or "hnsw"
+ANN_MIN_DOCS = int(os.getenv("ANN_MIN_DOCS", 2000))  # shards below this size stay exact
+IVF_NLIST = int(os.getenv("IVF_NLIST", 0))  # 0 picks 4 * sqrt(n) and retrains as the shard grows
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 8))
+HNSW_M = int(os.getenv("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 80))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))
+
+def target_nlist(count: int) -> int:
+    """Number of IVF lists for an index of count vectors."""
+    if IVF_NLIST:
+        return IVF_NLIST
+    # FAISS wants about 39 training points per list
+    return max(1, min(int(4 * math.sqrt(count)), count // 39))
+
+def build_ann_index(vectors: np.ndarray, index_type: str = GENERAL_INDEX_TYPE,
+                    nlist: int | None = None, hnsw_m: int = HNSW_M):
+    """Trains (for IVF) and fills an approximate index over vectors, keeping their row order as ids."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    dim = vectors.shape[1]
+    if index_type == "ivf":
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist or target_nlist(len(vectors)))
+        index.train(vectors)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    else:
+        raise ValueError(f"Unknown ANN index type: {index_type}")
+    index.add(vectors)
+    return index
+
+def set_search_params(index, nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH):
+    """Applies the search-time recall/latency knobs (they are not kept by faiss.write_index)."""
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = nprobe
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+def needs_training(index) -> bool:
+    """
+    True if the index should be (re)built in the configured ANN mode: a flat index that
+    reached ANN_MIN_DOCS, or an IVF index whose vector count calls for at least twice its lists.
+    """
+    if GENERAL_INDEX_TYPE not in ("ivf", "hnsw") or index.ntotal < ANN_MIN_DOCS:
+        return False
+    if isinstance(index, faiss.IndexFlat):
+        return True
+    if isinstance(index, faiss.IndexIVF) and GENERAL_INDEX_TYPE == "ivf":
+        return not IVF_NLIST and target_nlist(index.ntotal) >= 2 * index.nlist
+    return False
+
+def reconstruct_vectors(index, start: int, end: int) -> np.ndarray:
+    """Returns rows [start, end) of any flat, IVF or HNSW index."""
+    if isinstance(index, faiss.IndexIVF):
+        # IVF indexes can only reconstruct by id through a direct map
+        index.make_direct_map()
+    if end <= start:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(start, end - start)
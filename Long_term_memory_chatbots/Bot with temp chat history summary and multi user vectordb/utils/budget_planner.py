@@ -0,0 +1,118 @@
+from utils.token_counter import TokenCounter, count_text_tokens
+from utils.tracing import verbose
+
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# Configuration
+RESPONSE_TOKEN_RESERVE = int(os.getenv("RESPONSE_TOKEN_RESERVE", 256))  # tokens kept free for the answer
+
+# You can tune how the context window is shared between resources here.
+# priority: lower values are planned first and get first claim on unused tokens.
+# weight: share of the context budget reserved for the resource.
+# order: "recency" keeps the newest items (lists are oldest → newest),
+#        "relevance" keeps the first items (lists are best match first).
+RESOURCE_BUDGETS = {
+    "chat_history": {"priority": 1, "weight": 0.4, "order": "recency"},
+    "chat_summary": {"priority": 2, "weight": 0.2, "order": "recency"},
+    "user_vectordb_results": {"priority": 3, "weight": 0.2, "order": "relevance"},
+    "general_vectordb_results": {"priority": 4, "weight": 0.2, "order": "relevance"},
+}
+
+def _select_items(items: list, item_tokens: list, selected: set, budget: int, order: str) -> int:
+    """Greedily adds item indexes to selected while they fit in budget. Returns tokens spent."""
+    indexes = range(len(items) - 1, -1, -1) if order == "recency" else range(len(items))
+    spent = 0
+    for i in indexes:
+        if i in selected:
+            continue
+        if spent + item_tokens[i] > budget:
+            break
+        selected.add(i)
+        spent += item_tokens[i]
+    return spent
+
+def plan_context_budget(model: str, base_prompt: str, question: str, resources: dict) -> list:
+    """
+    Allocates the model context window across data resources in a single pass.
+
+    resources maps a resource name (see RESOURCE_BUDGETS) to (intro_text, items).
+    Every item is counted once. Each resource first gets its weighted share of the budget,
+    then unused tokens are handed out by priority. A resource whose items cannot fit at all
+    is marked for summarization within the tokens it was allotted.
+
+    Returns a list of plans in priority order, one per resource that gets any context:
+    {"name", "intro_text", "items", "summarize", "tokens"} where tokens is the budget
+    for the resource text (excluding its intro line).
+    """
+    # System prompt and question, including role markers
+    counter = TokenCounter(model)
+    counter.add_message("system", base_prompt)
+    counter.add_message("user", question)
+    budget = max(counter.remaining - RESPONSE_TOKEN_RESERVE, 0)
+
+    candidates = []
+    for name, (intro_text, items) in resources.items():
+        if not items:
+            verbose(f"No data found for {name}. Skipping injection.")
+            continue
+        config = RESOURCE_BUDGETS.get(name, {"priority": len(RESOURCE_BUDGETS) + 1, "weight": 0, "order": "relevance"})
+        items = [str(item) for item in items]
+        candidates.append({
+            "name": name,
+            "intro_text": intro_text,
+            "all_items": items,
+            # +1 for the newline joining items
+            "item_tokens": [count_text_tokens(item) + 1 for item in items],
+            "intro_tokens": count_text_tokens(f"\n\n{intro_text}\n"),
+            "config": config,
+            "selected": set(),
+            "spent": 0,
+        })
+    candidates.sort(key=lambda c: c["config"]["priority"])
+
+    # Pass 1: each resource fills its weighted share
+    total_weight = sum(c["config"]["weight"] for c in candidates) or 1
+    leftover = budget
+    for c in candidates:
+        share = int(budget * c["config"]["weight"] / total_weight)
+        available = max(share - c["intro_tokens"], 0)
+        c["spent"] = _select_items(c["all_items"], c["item_tokens"], c["selected"], available, c["config"]["order"])
+        if c["selected"]:
+            c["spent"] += c["intro_tokens"]
+        c["share"] = share
+        leftover -= c["spent"]
+
+    # Pass 2: hand out unused tokens by priority
+    for c in candidates:
+        if len(c["selected"]) == len(c["all_items"]):
+            continue
+        intro_cost = 0 if c["selected"] else c["intro_tokens"]
+        spent = _select_items(c["all_items"], c["item_tokens"], c["selected"], max(leftover - intro_cost, 0), c["config"]["order"])
+        if spent:
+            spent += intro_cost
+            c["spent"] += spent
+            leftover -= spent
+
+    plans = []
+    for c in candidates:
+        if c["selected"]:
+            items = [c["all_items"][i] for i in sorted(c["selected"])]
+            plans.append({"name": c["name"], "intro_text": c["intro_text"], "items": items,
+                          "summarize": False, "tokens": c["spent"] - c["intro_tokens"]})
+            verbose(f"Planned {len(items)}/{len(c['all_items'])} items of '{c['name']}' ({c['spent']} tokens)")
+            continue
+
+        # Not even one item fits: summarize the resource within its (unused) share
+        allotted = min(c["share"], leftover)
+        tokens = allotted - c["intro_tokens"]
+        if tokens <= 0:
+            verbose(f"⚠️ No context budget left for '{c['name']}'. Skipping injection.")
+            continue
+        leftover -= allotted
+        plans.append({"name": c["name"], "intro_text": c["intro_text"], "items": c["all_items"],
+                      "summarize": True, "tokens": tokens})
+        verbose(f"⚠️ '{c['name']}' does not fit its budget. Planned a summary of {tokens} tokens.")
+
+    return plans
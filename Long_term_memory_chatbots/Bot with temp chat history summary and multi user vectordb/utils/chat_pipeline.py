@@ -0,0 +1,74 @@
+from utils.retrieval_manager import retrieve_resources, aretrieve_resources
+from utils.get_response import stream_llm_response_with_resources, astream_llm_response_with_resources
+from utils.memory_manager import enqueue_memory_update
+from utils.tracing import trace_turn
+
+import asyncio
+
+def _get_prompt_resources(resources: dict) -> dict:
+    """Turns retrieved resources into the keyword arguments of the response functions."""
+    # chat_summary only holds the summaries older than the chat history (see get_older_chat_summaries)
+    return {
+        "chat_history": resources["chat_history"],
+        "chat_summary": resources["chat_summary"],
+        "user_vectordb_results": resources["user_vectordb_results"],
+        "general_vectordb_results": resources["general_vectordb_results"],
+    }
+
+def generate_response_stream(question, user_id):
+    """
+    Yields the response in chunks, then updates the databases in the background once it is complete.
+    If the stream is closed early (a Streamlit rerun), the part of the response already shown is saved.
+    """
+
+    with trace_turn(user_id):
+        # Fetch chat history, chat summary(s) and vector db search results concurrently
+        resources = retrieve_resources(question, user_id)
+
+        # Stream response from LLM using the prepared function, keeping the full text
+        chunks = []
+        try:
+            for chunk in stream_llm_response_with_resources(question=question, **_get_prompt_resources(resources)):
+                chunks.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            if chunks:
+                enqueue_memory_update(question, "".join(chunks), user_id)
+            raise
+        response = "".join(chunks)
+
+        # Queue database updates for the background workers
+        enqueue_memory_update(question, response, user_id)
+
+def generate_response(question, user_id):
+    # Return the full LLM response; databases are still updated by the background workers
+    return "".join(generate_response_stream(question, user_id))
+
+async def agenerate_response_stream(question, user_id):
+    """
+    Async generate_response_stream(): one event loop can serve many chat sessions at once.
+    LLM calls go through ollama.AsyncClient; SQLite and vector store calls run on the
+    shared retrieval executor and are awaited. If the stream is closed or cancelled early
+    (an SSE client disconnecting), the part of the response already sent is saved.
+    """
+    with trace_turn(user_id):
+        resources = await aretrieve_resources(question, user_id)
+
+        chunks = []
+        try:
+            async for chunk in astream_llm_response_with_resources(question=question, **_get_prompt_resources(resources)):
+                chunks.append(chunk)
+                yield chunk
+        except (GeneratorExit, asyncio.CancelledError):
+            if chunks:
+                # Shielded so the save finishes even though the request is being cancelled
+                await asyncio.shield(asyncio.to_thread(enqueue_memory_update, question, "".join(chunks), user_id))
+            raise
+        response = "".join(chunks)
+
+        # Saving the turn and enqueueing are SQLite writes, kept off the event loop
+        await asyncio.to_thread(enqueue_memory_update, question, response, user_id)
+
+async def agenerate_response(question, user_id):
+    """Async generate_response()."""
+    return "".join([chunk async for chunk in agenerate_response_stream(question, user_id)])
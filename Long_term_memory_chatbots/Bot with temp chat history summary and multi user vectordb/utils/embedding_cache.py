@@ -0,0 +1,132 @@
+from langchain_core.embeddings import Embeddings
+
+from utils.tracing import verbose
+
+import os
+import sqlite3
+import hashlib
+import threading
+from array import array
+from dotenv import load_dotenv
+load_dotenv()
+
+# Configuration
+EMBEDDING_CACHE_DB_NAME = os.getenv("EMBEDDING_CACHE_DB_NAME", "embedding_cache.db")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 100000))
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model with a persistent, content-addressed cache.
+    Vectors are stored as float32 blobs in SQLite keyed by (model, sha256(text)),
+    so repeated and duplicate texts never reach the underlying model twice.
+    Only documents are cached: search queries embed a new question every time and are passed
+    straight through. The table holds at most EMBEDDING_CACHE_MAX_ENTRIES vectors, oldest dropped first.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, db_path: str | None = None):
+        self.embeddings = embeddings
+        self.model = model
+        self.db_path = db_path or os.path.join("data", EMBEDDING_CACHE_DB_NAME)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._entries = 0
+
+    def _get_conn(self) -> sqlite3.Connection:
+        # Opened lazily so importing the module does not touch the disk
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # A cache entry lost in a power failure is simply embedded again
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )
+            """)
+            self._conn.commit()
+            self._entries = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        return self._conn
+
+    @staticmethod
+    def _hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lookup(self, hashes: list) -> dict:
+        found = {}
+        with self._lock:
+            conn = self._get_conn()
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND text_hash IN ({placeholders})",
+                    (self.model, *chunk)
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = array("f", blob).tolist()
+        return found
+
+    def _store(self, items: dict):
+        with self._lock:
+            conn = self._get_conn()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(self.model, text_hash, array("f", vector).tobytes()) for text_hash, vector in items.items()]
+            )
+            self._entries += len(items)
+            if self._entries > EMBEDDING_CACHE_MAX_ENTRIES:
+                # Trim to 90% of the limit, so this runs once per many writes rather than on every one
+                excess = self._entries - int(EMBEDDING_CACHE_MAX_ENTRIES * 0.9)
+                conn.execute(
+                    "DELETE FROM embedding_cache WHERE rowid IN (SELECT rowid FROM embedding_cache ORDER BY rowid LIMIT ?)",
+                    (excess,)
+                )
+                self._entries = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            conn.commit()
+
+    def _record(self, hits: int, misses: int):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+        stats = self.get_cache_stats()
+        verbose(f"Embedding cache hits: {hits}, misses: {misses} "
+                f"(overall hit rate: {stats['hit_rate']:.1%})")
+
+    def get_cache_stats(self) -> dict:
+        """Return cumulative cache hits, misses and hit rate for this process."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def embed_documents(self, texts: list) -> list:
+        hashes = [self._hash_text(text) for text in texts]
+        vectors = self._lookup(list(set(hashes)))
+
+        # Embed each missing text only once, even if it appears several times
+        missing = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in vectors:
+                missing.setdefault(text_hash, text)
+
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = dict(zip(missing.keys(), new_vectors))
+            self._store(new_items)
+            vectors.update(new_items)
+
+        self._record(hits=len(texts) - len(missing), misses=len(missing))
+        return [vectors[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> list:
+        # Queries are almost never repeated; caching them would only add a write to every search
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,220 @@
+from langchain_community.vectorstores import FAISS
+import numpy as np
+
+from utils.ann_index import reconstruct_vectors
+from utils.tracing import verbose
+
+import os
+import json
+import shutil
+
+# Incremental on-disk format for FAISS stores.
+#
+# <store>/CURRENT                    generation number of the live snapshot
+# <store>/snapshot-<gen>/            full FAISS.save_local snapshot (absent until the first compaction),
+#                                    plus the same vectors and texts as flat files for memory-mapped reads:
+#                                    vectors.f32 (n x dim float32), texts.bin (utf-8), offsets.u64 (n + 1 offsets)
+# <store>/segments-<gen>.f32         float32 vectors appended since that snapshot
+# <store>/docstore-<gen>.log         one JSON line per appended vector: {"id", "text", "metadata", "dim"}
+#
+# Appends only write to the two log files, so they cost O(new vectors). Compaction writes a new
+# snapshot into a fresh directory and then atomically switches CURRENT to it, so a crash at any
+# point leaves a consistent snapshot + log pair. Stores saved with plain FAISS.save_local (no CURRENT
+# file) are read as generation 0 with the snapshot in the store directory itself.
+
+def read_generation(path: str) -> int:
+    current_file = os.path.join(path, "CURRENT")
+    if not os.path.exists(current_file):
+        return 0
+    with open(current_file) as f:
+        return int(f.read().strip())
+
+def get_snapshot_path(path: str, generation: int) -> str:
+    if generation == 0:
+        return path
+    return os.path.join(path, f"snapshot-{generation}")
+
+def get_log_paths(path: str, generation: int) -> tuple[str, str]:
+    return (
+        os.path.join(path, f"segments-{generation}.f32"),
+        os.path.join(path, f"docstore-{generation}.log")
+    )
+
+def export_flat_vectors(snapshot_dir: str, db: FAISS):
+    """Writes the vectors and texts of db as flat files next to its snapshot (see utils/mmap_store.py)."""
+    count = db.index.ntotal
+    vectors = reconstruct_vectors(db.index, 0, count)
+    np.asarray(vectors, dtype=np.float32).tofile(os.path.join(snapshot_dir, "vectors.f32"))
+
+    offsets = [0]
+    with open(os.path.join(snapshot_dir, "texts.bin"), "wb") as f:
+        for i in range(count):
+            text = db.docstore.search(db.index_to_docstore_id[i]).page_content.encode("utf-8")
+            f.write(text)
+            offsets.append(offsets[-1] + len(text))
+    np.asarray(offsets, dtype=np.uint64).tofile(os.path.join(snapshot_dir, "offsets.u64"))
+
+def store_exists(path: str) -> bool:
+    generation = read_generation(path)
+    segments_path, _ = get_log_paths(path, generation)
+    return (
+        os.path.exists(os.path.join(get_snapshot_path(path, generation), "index.faiss"))
+        or os.path.exists(segments_path)
+    )
+
+def read_log_lines(docstore_path: str, start: int = 0) -> tuple[list, list]:
+    """Returns the complete JSON entries of a docstore log from byte offset start, and the byte offset after each."""
+    entries = []
+    line_ends = []
+    if not os.path.exists(docstore_path):
+        return entries, line_ends
+    with open(docstore_path, "rb") as f:
+        f.seek(start)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+            line_ends.append((line_ends[-1] if line_ends else start) + len(line))
+    return entries, line_ends
+
+def read_log(path: str, generation: int) -> tuple[list, np.ndarray | None, int]:
+    """
+    Reads the appended entries and vectors, dropping (and truncating) a torn write at the tail.
+    Also returns the byte offset where the entries read end (see read_log_tail).
+    """
+    segments_path, docstore_path = get_log_paths(path, generation)
+    if not os.path.exists(docstore_path) or not os.path.exists(segments_path):
+        return [], None, 0
+
+    entries, line_ends = read_log_lines(docstore_path)
+    if not entries:
+        return [], None, 0
+
+    dim = entries[0]["dim"]
+    vectors = np.fromfile(segments_path, dtype=np.float32)
+    count = min(len(entries), len(vectors) // dim)
+    entries = entries[:count]
+
+    # Cut off anything past the last complete entry so later appends stay aligned
+    log_bytes = line_ends[count - 1] if count else 0
+    if os.path.getsize(docstore_path) != log_bytes:
+        os.truncate(docstore_path, log_bytes)
+    if len(vectors) != count * dim:
+        os.truncate(segments_path, count * dim * 4)
+
+    return entries, vectors[:count * dim].reshape(count, dim), log_bytes
+
+def get_log_size(path: str, generation: int) -> int:
+    """Size of the docstore log in bytes; it only grows until the next compaction."""
+    _, docstore_path = get_log_paths(path, generation)
+    try:
+        return os.path.getsize(docstore_path)
+    except FileNotFoundError:
+        return 0
+
+def read_log_tail(path: str, generation: int, start: int, start_count: int) -> tuple[list, np.ndarray | None, int]:
+    """
+    Reads the entries appended after byte offset start of the log, which holds start_count entries
+    before it, with their vectors. Returns (entries, vectors, end offset). Unlike read_log it never
+    truncates, so a reader can call it while another process appends.
+    """
+    segments_path, docstore_path = get_log_paths(path, generation)
+    entries, line_ends = read_log_lines(docstore_path, start)
+    if not entries:
+        return [], None, start
+
+    # Vectors are written before their lines, so every complete line has its vector on disk
+    dim = entries[0]["dim"]
+    count = min(len(entries), max(os.path.getsize(segments_path) // (4 * dim) - start_count, 0))
+    if not count:
+        return [], None, start
+    vectors = np.fromfile(segments_path, dtype=np.float32, count=count * dim, offset=start_count * dim * 4)
+    return entries[:count], vectors.reshape(count, dim), line_ends[count - 1]
+
+def load_store(path: str, embeddings) -> tuple[FAISS | None, tuple]:
+    """
+    Loads the latest snapshot and replays the appended entries on top of it. Returns (store, log position):
+    the store is None if there is none, and the log position it was read up to, (generation, log bytes,
+    log entries), is where read_log_tail picks up later appends.
+    """
+    if not store_exists(path):
+        return None, (0, 0, 0)
+
+    generation = read_generation(path)
+    snapshot_path = get_snapshot_path(path, generation)
+    db = None
+    if os.path.exists(os.path.join(snapshot_path, "index.faiss")):
+        db = FAISS.load_local(snapshot_path, embeddings, allow_dangerous_deserialization=True)
+
+    entries, vectors, log_bytes = read_log(path, generation)
+    if entries:
+        text_embeddings = [(entry["text"], vector.tolist()) for entry, vector in zip(entries, vectors)]
+        metadatas = [entry["metadata"] for entry in entries]
+        ids = [entry["id"] for entry in entries]
+        if db is None:
+            db = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+        else:
+            db.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        verbose(f"Replayed {len(entries)} appended vectors for {path}")
+
+    return db, (generation, log_bytes, len(entries))
+
+def append_entries(path: str, entries: list) -> int:
+    """
+    Appends (id, text, metadata, vector) entries to the store's log files.
+    Returns the number of entries in the log since the last snapshot.
+    """
+    os.makedirs(path, exist_ok=True)
+    generation = read_generation(path)
+    segments_path, docstore_path = get_log_paths(path, generation)
+
+    vectors = np.asarray([entry[3] for entry in entries], dtype=np.float32)
+    # Vectors first: a torn docstore line is detected on load, a vector without a line is cut off
+    with open(segments_path, "ab") as f:
+        vectors.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    with open(docstore_path, "a") as f:
+        for doc_id, text, metadata, vector in entries:
+            f.write(json.dumps({"id": doc_id, "text": text, "metadata": metadata, "dim": len(vector)}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    return os.path.getsize(segments_path) // (4 * len(entries[0][3]))
+
+def compact_store(path: str, db: FAISS):
+    """
+    Writes the full in-memory store as a new snapshot and starts an empty log.
+    Must be called with no appends in flight for this store.
+    """
+    os.makedirs(path, exist_ok=True)
+    old_generation = read_generation(path)
+    generation = old_generation + 1
+
+    db.save_local(get_snapshot_path(path, generation))
+    export_flat_vectors(get_snapshot_path(path, generation), db)
+
+    # Atomically switch to the new snapshot
+    current_tmp = os.path.join(path, "CURRENT.tmp")
+    with open(current_tmp, "w") as f:
+        f.write(str(generation))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(current_tmp, os.path.join(path, "CURRENT"))
+
+    # The previous snapshot and log are now garbage
+    for old_file in get_log_paths(path, old_generation):
+        if os.path.exists(old_file):
+            os.remove(old_file)
+    if old_generation == 0:
+        for name in ("index.faiss", "index.pkl"):
+            old_file = os.path.join(path, name)
+            if os.path.exists(old_file):
+                os.remove(old_file)
+    else:
+        shutil.rmtree(get_snapshot_path(path, old_generation), ignore_errors=True)
+
+    verbose(f"Compacted vector store {path} into snapshot {generation}")
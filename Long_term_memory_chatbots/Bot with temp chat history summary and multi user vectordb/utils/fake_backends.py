@@ -0,0 +1,114 @@
+from langchain_core.embeddings import Embeddings
+
+import os
+import re
+import json
+import math
+import time
+import asyncio
+import hashlib
+from dotenv import load_dotenv
+load_dotenv()
+
+# Configuration
+FAKE_LLM_FIRST_TOKEN_MS = float(os.getenv("FAKE_LLM_FIRST_TOKEN_MS", 200))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", 50))
+FAKE_LLM_MAX_TOKENS = int(os.getenv("FAKE_LLM_MAX_TOKENS", 60))
+HASH_EMBEDDING_DIM = int(os.getenv("HASH_EMBEDDING_DIM", 384))
+
+# Offline stand-ins for ollama (LLM_BACKEND=fake, EMBEDDING_BACKEND=hash), so the pipeline can be
+# load-tested without a model server. Same inputs always give the same outputs.
+
+def fake_reply_tokens(messages: list, format: str | None = None) -> list:
+    """Reply to messages as a list of chunks; valid JSON with both summaries when format="json"."""
+    last = messages[-1]["content"] if messages else ""
+    digest = hashlib.sha256(last.encode("utf-8")).hexdigest()[:8]
+    if format == "json":
+        return [json.dumps({
+            "user_summary": f"Summary {digest} of the conversation: {last[-200:]}",
+            "general_summary": f"General summary {digest}."
+        })]
+    words = f"Fake answer {digest} to: {last}".split()
+    return [f"{word} " for word in words[:FAKE_LLM_MAX_TOKENS]]
+
+def _fake_delays() -> tuple[float, float]:
+    """(seconds before the first chunk, seconds between chunks)."""
+    return FAKE_LLM_FIRST_TOKEN_MS / 1000, 1 / FAKE_LLM_TOKENS_PER_SECOND
+
+def _fake_message(content: str, done: bool) -> dict:
+    return {"message": {"role": "assistant", "content": content}, "done": done}
+
+def _fake_done_message(content: str, messages: list, chunks: list) -> dict:
+    """Final message, with rough prompt and completion token counts like ollama reports them."""
+    prompt = " ".join(message["content"] for message in messages)
+    return {
+        **_fake_message(content, True),
+        "prompt_eval_count": len(re.findall(r"\w+|[^\w\s]", prompt)),
+        "eval_count": len(chunks),
+    }
+
+class FakeChatClient:
+    """Drop-in for ollama.Client.chat with configurable first-token latency and token rate."""
+
+    def chat(self, model: str = "", messages: list | None = None, stream: bool = False,
+             format: str | None = None, **kwargs):
+        chunks = fake_reply_tokens(messages or [], format)
+        first_delay, chunk_delay = _fake_delays()
+        if not stream:
+            time.sleep(first_delay + chunk_delay * len(chunks))
+            return _fake_done_message("".join(chunks), messages or [], chunks)
+
+        def stream_chunks():
+            time.sleep(first_delay)
+            for chunk in chunks:
+                yield _fake_message(chunk, False)
+                time.sleep(chunk_delay)
+            yield _fake_done_message("", messages or [], chunks)
+        return stream_chunks()
+
+class FakeAsyncChatClient:
+    """Drop-in for ollama.AsyncClient.chat, see FakeChatClient."""
+
+    async def chat(self, model: str = "", messages: list | None = None, stream: bool = False,
+                   format: str | None = None, **kwargs):
+        chunks = fake_reply_tokens(messages or [], format)
+        first_delay, chunk_delay = _fake_delays()
+        if not stream:
+            await asyncio.sleep(first_delay + chunk_delay * len(chunks))
+            return _fake_done_message("".join(chunks), messages or [], chunks)
+
+        async def stream_chunks():
+            await asyncio.sleep(first_delay)
+            for chunk in chunks:
+                yield _fake_message(chunk, False)
+                await asyncio.sleep(chunk_delay)
+            yield _fake_done_message("", messages or [], chunks)
+        return stream_chunks()
+
+class HashEmbeddings(Embeddings):
+    """
+    Feature-hashing embeddings: every word is hashed to a signed bucket of a dim-sized vector,
+    then the vector is L2-normalized. Texts sharing words get similar vectors, so vector search
+    still returns meaningful neighbours.
+    """
+
+    def __init__(self, dim: int = HASH_EMBEDDING_DIM):
+        self.dim = dim
+
+    def _embed(self, text: str) -> list:
+        vector = [0.0] * self.dim
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector))
+        if norm == 0:
+            # Empty or word-less text: a fixed unit vector keeps FAISS and cosine search well-defined
+            vector[0] = norm = 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed(text)
@@ -1,11 +1,17 @@
 import os
+import asyncio
 from utils.response_manager import (
     get_llm_response,
-    build_messageslist,
+    stream_llm_response,
+    aget_llm_response,
+    astream_llm_response,
     prepare_basic_chat_system_prompt,
     summarize_within_token_limit,
+    asummarize_within_token_limit,
 )
-from utils.token_counter import is_contextwindow_full
+from utils.token_counter import count_text_tokens
+from utils.budget_planner import plan_context_budget
+from utils.tracing import verbose, span
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -20,100 +26,203 @@ def prepare_llm_response_with_resources(
     general_vectordb_results: list | None = None,
 ) -> str:
     """
-    Builds a prompt progressively using available data resources.
-    Summarizes and generates intermediate response only if context window is breached.
-    Max iterations controlled by .env variable MAX_SUMMARIZATION_ITERATIONS.
+    Generates the LLM response using a prompt built from the available data resources.
     """
-
-    basic_prompt = prepare_basic_chat_system_prompt()
-    print("VERBOSE: Initialized base system prompt")
-
-    def get_remaining_tokens(temp_prompt: str) -> tuple[int, int]:
-        messages = build_messageslist(temp_prompt, question)
-        context_info = is_contextwindow_full(OLLAMA_MODEL, messages)
-        return context_info.get("remaining", 0), context_info.get("used", 0)
-
-    def inject_data_resource(prompt: str, resource: list | None, resource_name: str, intro_text: str) -> str:
-        if not resource:
-            print(f"VERBOSE: No data found for {resource_name}. Skipping injection.")
-            return prompt
-
-        data_slice = resource[-min(len(resource), 100):]
-
-        iteration = 0
-        while iteration < (int(MAX_ITERATIONS+1)):
-            remaining_tokens, used_tokens = get_remaining_tokens(prompt)
-            print(f"VERBOSE: Attempting to inject '{resource_name}' (Tokens used: {used_tokens}, Remaining: {remaining_tokens})")
-
-            # Decide whether to summarize or inject directly
-            estimated_tokens_needed = sum(len(str(d)) // 4 for d in data_slice)  # rough estimate
-            if remaining_tokens < estimated_tokens_needed:
-                print(f"VERBOSE: ⚠️ Resource '{resource_name}' may exceed context window. Summarizing...")
-                resource_text = summarize_within_token_limit(
-                    data=data_slice,
-                    remaining_tokens=remaining_tokens,
-                    question=question
-                )
-                print(f"VERBOSE: Resource '{resource_name}' summarized for injection.")
-            else:
-                resource_text = "\n".join(map(str, data_slice))
-
-            temp_prompt = prompt + "\n\n" + f"{intro_text}\n" + resource_text
-            remaining_after, used_after = get_remaining_tokens(temp_prompt)
-
-            if remaining_after > 0:
-                print(f"VERBOSE: Successfully injected '{resource_name}'. Tokens used: {used_after}, Remaining: {remaining_after}")
-                return temp_prompt
-            
-            iteration += 1
-            
-            if iteration == MAX_ITERATIONS:
-                print(f"VERBOSE: ⚠️ Context window breached after adding '{resource_name}', generating intermediate response...")
-                intermediate_response = get_llm_response(temp_prompt, question)
-                print(f"VERBOSE: Intermediate response generated after context breach for '{resource_name}'.")
-                prompt = basic_prompt + "\n\n" + f"Here is a summarized version of prior information:\n{intermediate_response}"
-                print(f"VERBOSE: Rebuilt prompt after summarizing '{resource_name}', iteration {iteration}.")
-
-        print(f"VERBOSE: Maximum summarization iterations reached for '{resource_name}'. Proceeding with current prompt.")
-        return prompt
-
-    # Inject resources
-    prompt = inject_data_resource(
-        prompt=basic_prompt,
-        resource=chat_history,
-        resource_name="chat_history",
-        intro_text="Here is the recent chat history between user and assistant:"
+    prompt = prepare_llm_prompt_with_resources(
+        question=question,
+        chat_history=chat_history,
+        chat_summary=chat_summary,
+        user_vectordb_results=user_vectordb_results,
+        general_vectordb_results=general_vectordb_results
     )
 
-    prompt = inject_data_resource(
-        prompt=prompt,
-        resource=chat_summary,
-        resource_name="chat_summary",
-        intro_text="Here is a summary of the most recent conversations:"
+    verbose("Generating final LLM response...")
+    final_response = get_llm_response(prompt, question)
+    verbose("LLM response successfully generated.")
+
+    return final_response
+
+def stream_llm_response_with_resources(
+    question: str,
+    chat_history: list | None = None,
+    chat_summary: list | None = None,
+    user_vectordb_results: list | None = None,
+    general_vectordb_results: list | None = None,
+):
+    """
+    Same as prepare_llm_response_with_resources, but yields the response in chunks as they are generated.
+    """
+    prompt = prepare_llm_prompt_with_resources(
+        question=question,
+        chat_history=chat_history,
+        chat_summary=chat_summary,
+        user_vectordb_results=user_vectordb_results,
+        general_vectordb_results=general_vectordb_results
     )
 
-    prompt = inject_data_resource(
-        prompt=prompt,
-        resource=user_vectordb_results,
-        resource_name="user_vectordb_results",
-        intro_text=(
-            "Here are the similarity search results of the most recent user-specific information "
-            "retrieved from the database based on user query:"
-        )
+    verbose("Streaming final LLM response...")
+    yield from stream_llm_response(prompt, question)
+    verbose("LLM response successfully streamed.")
+
+def prepare_llm_prompt_with_resources(
+    question: str,
+    chat_history: list | None = None,
+    chat_summary: list | None = None,
+    user_vectordb_results: list | None = None,
+    general_vectordb_results: list | None = None,
+) -> str:
+    """
+    Builds the prompt in one linear pass from a token budget plan over the available data resources.
+    Calls the LLM to summarize a resource only when none of its items fit the budget; the summary is
+    retried up to MAX_SUMMARIZATION_ITERATIONS times if it comes back over its allotted tokens.
+    """
+    with span("prompt.build") as s:
+        basic_prompt, plans = plan_prompt(question, chat_history, chat_summary, user_vectordb_results, general_vectordb_results)
+        resource_texts = [
+            summarize_resource(plan["items"], plan["tokens"], question) if plan["summarize"] else "\n".join(plan["items"])
+            for plan in plans
+        ]
+        s.set(resources=len(plans), summarized=sum(plan["summarize"] for plan in plans))
+        return assemble_prompt(basic_prompt, plans, resource_texts)
+
+def plan_prompt(
+    question: str,
+    chat_history: list | None = None,
+    chat_summary: list | None = None,
+    user_vectordb_results: list | None = None,
+    general_vectordb_results: list | None = None,
+) -> tuple[str, list]:
+    """Returns the base system prompt and the token budget plans of the data resources."""
+    basic_prompt = prepare_basic_chat_system_prompt()
+    verbose("Initialized base system prompt")
+
+    plans = plan_context_budget(
+        model=OLLAMA_MODEL,
+        base_prompt=basic_prompt,
+        question=question,
+        resources={
+            "chat_history": (
+                "Here is the recent chat history between user and assistant:",
+                chat_history
+            ),
+            "chat_summary": (
+                "Here is a summary of the most recent conversations:",
+                chat_summary
+            ),
+            "user_vectordb_results": (
+                "Here are the similarity search results of the most recent user-specific information "
+                "retrieved from the database based on user query:",
+                user_vectordb_results
+            ),
+            "general_vectordb_results": (
+                "Here are the similarity search results of the most recent general knowledge information "
+                "retrieved from the database based on user query:",
+                general_vectordb_results
+            ),
+        }
     )
 
-    prompt = inject_data_resource(
-        prompt=prompt,
-        resource=general_vectordb_results,
-        resource_name="general_vectordb_results",
-        intro_text=(
-            "Here are the similarity search results of the most recent general knowledge information "
-            "retrieved from the database based on user query:"
+    return basic_prompt, plans
+
+def assemble_prompt(basic_prompt: str, plans: list, resource_texts: list) -> str:
+    """Joins the base prompt with each planned resource's text (None when its summary did not fit)."""
+    prompt_parts = [basic_prompt]
+    for plan, resource_text in zip(plans, resource_texts):
+        if not resource_text:
+            verbose(f"⚠️ Could not fit a summary of '{plan['name']}'. Skipping injection.")
+            continue
+        prompt_parts.append(f"{plan['intro_text']}\n{resource_text}")
+        verbose(f"Successfully injected '{plan['name']}'.")
+
+    return "\n\n".join(prompt_parts)
+
+def summarize_resource(items: list, max_tokens: int, question: str) -> str | None:
+    """
+    Summarizes resource items to fit within max_tokens.
+    Returns None if no summary fits after MAX_ITERATIONS attempts.
+    """
+    for iteration in range(1, MAX_ITERATIONS + 1):
+        verbose(f"Summarizing resource within {max_tokens} tokens (attempt {iteration})...")
+        summary = summarize_within_token_limit(
+            data=items,
+            remaining_tokens=max_tokens,
+            question=question
+        )
+        if count_text_tokens(summary) <= max_tokens:
+            return summary
+    return None
+
+async def asummarize_resource(items: list, max_tokens: int, question: str) -> str | None:
+    """Async summarize_resource()."""
+    for iteration in range(1, MAX_ITERATIONS + 1):
+        verbose(f"Summarizing resource within {max_tokens} tokens (attempt {iteration})...")
+        summary = await asummarize_within_token_limit(
+            data=items,
+            remaining_tokens=max_tokens,
+            question=question
         )
+        if count_text_tokens(summary) <= max_tokens:
+            return summary
+    return None
+
+async def aprepare_llm_prompt_with_resources(
+    question: str,
+    chat_history: list | None = None,
+    chat_summary: list | None = None,
+    user_vectordb_results: list | None = None,
+    general_vectordb_results: list | None = None,
+) -> str:
+    """Async prepare_llm_prompt_with_resources(); resources that need a summary are summarized concurrently."""
+    async def resource_text(plan):
+        if plan["summarize"]:
+            return await asummarize_resource(plan["items"], plan["tokens"], question)
+        return "\n".join(plan["items"])
+
+    with span("prompt.build") as s:
+        basic_prompt, plans = plan_prompt(question, chat_history, chat_summary, user_vectordb_results, general_vectordb_results)
+        resource_texts = await asyncio.gather(*(resource_text(plan) for plan in plans))
+        s.set(resources=len(plans), summarized=sum(plan["summarize"] for plan in plans))
+        return assemble_prompt(basic_prompt, plans, resource_texts)
+
+async def aprepare_llm_response_with_resources(
+    question: str,
+    chat_history: list | None = None,
+    chat_summary: list | None = None,
+    user_vectordb_results: list | None = None,
+    general_vectordb_results: list | None = None,
+) -> str:
+    """Async prepare_llm_response_with_resources() on ollama.AsyncClient."""
+    prompt = await aprepare_llm_prompt_with_resources(
+        question=question,
+        chat_history=chat_history,
+        chat_summary=chat_summary,
+        user_vectordb_results=user_vectordb_results,
+        general_vectordb_results=general_vectordb_results
     )
 
-    print("VERBOSE: Generating final LLM response...")
-    final_response = get_llm_response(prompt, question)
-    print("VERBOSE: LLM response successfully generated.")
+    verbose("Generating final LLM response...")
+    final_response = await aget_llm_response(prompt, question)
+    verbose("LLM response successfully generated.")
+
+    return final_response
+
+async def astream_llm_response_with_resources(
+    question: str,
+    chat_history: list | None = None,
+    chat_summary: list | None = None,
+    user_vectordb_results: list | None = None,
+    general_vectordb_results: list | None = None,
+):
+    """Async stream_llm_response_with_resources() on ollama.AsyncClient."""
+    prompt = await aprepare_llm_prompt_with_resources(
+        question=question,
+        chat_history=chat_history,
+        chat_summary=chat_summary,
+        user_vectordb_results=user_vectordb_results,
+        general_vectordb_results=general_vectordb_results
+    )
 
-    return final_response
\ No newline at end of file
+    verbose("Streaming final LLM response...")
+    async for chunk in astream_llm_response(prompt, question):
+        yield chunk
+    verbose("LLM response successfully streamed.")
@@ -0,0 +1,235 @@
+import json
+import time
+import threading
+
+from utils.sql_manager import get_connection
+from utils.vectorstore_manager import acquire_general_writer_lock
+from utils.tracing import verbose
+
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# Configuration
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_QUEUE_MAX_PENDING = int(os.getenv("JOB_QUEUE_MAX_PENDING", 1000))
+JOB_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("JOB_ENQUEUE_TIMEOUT_SECONDS", 10))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", 1))
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", 5))
+JOB_RETRY_MAX_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_MAX_BACKOFF_SECONDS", 300))
+
+_job_handlers = {}
+_queue_changed = threading.Condition()
+_workers = []
+_workers_lock = threading.Lock()
+_metrics = {"runs": 0, "completed": 0, "batches": 0, "failed": 0, "retried": 0, "total_wait_seconds": 0.0, "total_run_seconds": 0.0}
+
+def register_job_handler(kind: str, handler, quiet_seconds: float = 0, max_batch: int = 1):
+    """
+    Registers handler(user_id, payloads) to run jobs of the given kind.
+    With max_batch > 1, pending jobs of the same user and kind are coalesced into one run:
+    they wait until the user has been quiet for quiet_seconds (or max_batch jobs are pending)
+    and the handler receives all their payloads, oldest first.
+    """
+    _job_handlers[kind] = {"handler": handler, "quiet_seconds": quiet_seconds, "max_batch": max_batch}
+
+def _count_pending() -> int:
+    with get_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM memory_jobs WHERE status = 'pending'").fetchone()[0]
+
+def enqueue_job(kind: str, user_id: str, payload: dict) -> int:
+    """
+    Persists a job and wakes a worker. Jobs of the same user run one at a time, in order.
+    Blocks while the queue holds JOB_QUEUE_MAX_PENDING jobs and raises RuntimeError if it
+    does not drain within JOB_ENQUEUE_TIMEOUT_SECONDS.
+    """
+    deadline = time.monotonic() + JOB_ENQUEUE_TIMEOUT_SECONDS
+    # The condition is only held to wait and notify, never across SQLite calls
+    while _count_pending() >= JOB_QUEUE_MAX_PENDING:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RuntimeError(f"Job queue is full ({JOB_QUEUE_MAX_PENDING} pending jobs)")
+        with _queue_changed:
+            _queue_changed.wait(min(remaining, JOB_POLL_INTERVAL_SECONDS))
+
+    with get_connection() as conn:
+        cursor = conn.execute(
+            "INSERT INTO memory_jobs (kind, user_id, payload, status, attempts, created_at) VALUES (?, ?, ?, 'pending', 0, ?)",
+            (kind, user_id, json.dumps(payload), time.time())
+        )
+        conn.commit()
+        job_id = cursor.lastrowid
+    with _queue_changed:
+        _queue_changed.notify_all()
+
+    verbose(f"Enqueued {kind} job {job_id} for user {user_id}")
+    return job_id
+
+def _is_ready(kind: str, count: int, newest_created_at: float) -> bool:
+    config = _job_handlers.get(kind)
+    if config is None or config["max_batch"] <= 1:
+        return True
+    return count >= config["max_batch"] or time.time() - newest_created_at >= config["quiet_seconds"]
+
+def _claim_next_job():
+    """Marks the oldest runnable batch of jobs as running and returns it, or None if there is nothing to run."""
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        # Skip users that already have a running job, or a failed one waiting out its retry backoff,
+        # so each user's jobs stay in order
+        groups = conn.execute("""
+            SELECT user_id, kind, MIN(id), COUNT(*), MAX(created_at), MIN(created_at) FROM memory_jobs AS job
+            WHERE status = 'pending'
+              AND NOT EXISTS (
+                  SELECT 1 FROM memory_jobs AS blocking
+                  WHERE blocking.user_id = job.user_id
+                    AND (blocking.status = 'running' OR (blocking.status = 'pending' AND blocking.next_attempt_at > ?))
+              )
+            GROUP BY user_id, kind
+            ORDER BY MIN(id)
+        """, (time.time(),)).fetchall()
+
+        seen_users = set()
+        claimed = None
+        for user_id, kind, _, count, newest_created_at, oldest_created_at in groups:
+            # Only a user's oldest kind of job may run next
+            if user_id in seen_users:
+                continue
+            seen_users.add(user_id)
+            if _is_ready(kind, count, newest_created_at):
+                claimed = (user_id, kind, oldest_created_at)
+                break
+
+        if claimed is None:
+            conn.rollback()
+            return None
+
+        user_id, kind, created_at = claimed
+        max_batch = _job_handlers[kind]["max_batch"] if kind in _job_handlers else 1
+        rows = conn.execute(
+            "SELECT id, payload, attempts FROM memory_jobs WHERE user_id = ? AND kind = ? AND status = 'pending' ORDER BY id LIMIT ?",
+            (user_id, kind, max_batch)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE memory_jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?",
+            [(time.time(), row[0]) for row in rows]
+        )
+        conn.commit()
+    return {"ids": [row[0] for row in rows], "kind": kind, "user_id": user_id,
+            "payloads": [json.loads(row[1]) for row in rows],
+            "attempts": max(row[2] for row in rows) + 1, "created_at": created_at}
+
+def _finish_job(job: dict, error: Exception | None):
+    ids = [(job_id,) for job_id in job["ids"]]
+    with get_connection() as conn:
+        if error is None:
+            # Completed jobs are removed; failed ones are kept for inspection
+            conn.executemany("DELETE FROM memory_jobs WHERE id = ?", ids)
+        elif job["attempts"] >= JOB_MAX_ATTEMPTS:
+            conn.executemany(
+                "UPDATE memory_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                [(repr(error), time.time(), job_id) for (job_id,) in ids]
+            )
+        else:
+            # Retry after JOB_RETRY_BACKOFF_SECONDS, doubling with every failed attempt
+            backoff = min(JOB_RETRY_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1), JOB_RETRY_MAX_BACKOFF_SECONDS)
+            conn.executemany(
+                "UPDATE memory_jobs SET status = 'pending', error = ?, next_attempt_at = ? WHERE id = ?",
+                [(repr(error), time.time() + backoff, job_id) for (job_id,) in ids]
+            )
+        conn.commit()
+
+def _run_job(job: dict):
+    started = time.time()
+    error = None
+    try:
+        _job_handlers[job["kind"]]["handler"](job["user_id"], job["payloads"])
+    except Exception as e:
+        error = e
+        verbose(f"⚠️ Jobs {job['ids']} ({job['kind']}) failed on attempt {job['attempts']}: {e}")
+    _finish_job(job, error)
+
+    with _queue_changed:
+        _metrics["total_wait_seconds"] += started - job["created_at"]
+        _metrics["total_run_seconds"] += time.time() - started
+        _metrics["runs"] += 1
+        if error is None:
+            _metrics["completed"] += len(job["ids"])
+            _metrics["batches"] += 1
+        elif job["attempts"] >= JOB_MAX_ATTEMPTS:
+            _metrics["failed"] += len(job["ids"])
+        else:
+            _metrics["retried"] += len(job["ids"])
+        _queue_changed.notify_all()
+
+def _worker_loop():
+    while True:
+        try:
+            job = _claim_next_job()
+        except Exception as e:
+            verbose(f"⚠️ Could not claim a job: {e}")
+            job = None
+        if job is None:
+            with _queue_changed:
+                _queue_changed.wait(JOB_POLL_INTERVAL_SECONDS)
+            continue
+        _run_job(job)
+
+def start_job_workers():
+    """
+    Starts the background worker pool once per process (safe to call on every Streamlit rerun).
+    Only the process holding the knowledge store writer lock runs workers, so jobs it finds running
+    were left by a previous owner that died and are put back in the queue first. Other processes only
+    enqueue jobs and try to take over on their next call; with JOB_WORKERS=0 a process never runs them.
+    Jobs that used up their attempts stay failed, for inspection.
+    """
+    if JOB_WORKERS <= 0:
+        return
+    with _workers_lock:
+        if _workers:
+            return
+        try:
+            acquire_general_writer_lock()
+        except RuntimeError as e:
+            verbose(f"Not starting job workers: {e}")
+            return
+
+        with get_connection() as conn:
+            replayed = conn.execute(
+                "UPDATE memory_jobs SET status = 'pending' WHERE status = 'running'"
+            ).rowcount
+            conn.commit()
+        if replayed:
+            verbose(f"Replaying {replayed} interrupted jobs")
+
+        for i in range(JOB_WORKERS):
+            worker = threading.Thread(target=_worker_loop, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+    verbose(f"Started {JOB_WORKERS} job workers")
+
+def get_job_queue_metrics() -> dict:
+    """Returns queue depth by status, age of the oldest pending job and per-process throughput counters."""
+    with get_connection() as conn:
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM memory_jobs GROUP BY status").fetchall())
+        oldest = conn.execute("SELECT MIN(created_at) FROM memory_jobs WHERE status = 'pending'").fetchone()[0]
+
+    with _queue_changed:
+        metrics = dict(_metrics)
+    runs = metrics["runs"]
+    return {
+        "pending": counts.get("pending", 0),
+        "running": counts.get("running", 0),
+        "failed_total": counts.get("failed", 0),
+        "oldest_pending_age_seconds": time.time() - oldest if oldest else 0.0,
+        "max_pending": JOB_QUEUE_MAX_PENDING,
+        "workers": len(_workers),
+        "completed": metrics["completed"],
+        "failed": metrics["failed"],
+        "retried": metrics["retried"],
+        "batches": metrics["batches"],
+        "avg_batch_size": metrics["completed"] / metrics["batches"] if metrics["batches"] else 0.0,
+        "avg_wait_seconds": metrics["total_wait_seconds"] / runs if runs else 0.0,
+        "avg_run_seconds": metrics["total_run_seconds"] / runs if runs else 0.0,
+    }
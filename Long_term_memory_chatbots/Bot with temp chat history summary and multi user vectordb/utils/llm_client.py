@@ -0,0 +1,211 @@
+import ollama
+
+from utils.fake_backends import FakeChatClient, FakeAsyncChatClient
+from utils.tracing import verbose, span
+
+import os
+import time
+import asyncio
+import weakref
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from dotenv import load_dotenv
+load_dotenv()
+
+# Configuration
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL")
+LLM_BACKEND = os.getenv("LLM_BACKEND", "ollama")  # "ollama" or "fake" (offline stand-in, see utils/fake_backends.py)
+OLLAMA_HOST = os.getenv("OLLAMA_HOST")  # None uses the ollama default (http://localhost:11434)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # how long the server keeps the model loaded
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 2))
+LLM_BACKGROUND_MAX_CONCURRENCY = int(os.getenv("LLM_BACKGROUND_MAX_CONCURRENCY", max(LLM_MAX_CONCURRENCY - 1, 1)))
+
+# Priority classes: queued interactive requests always start before queued background ones
+INTERACTIVE = "interactive"  # answers a user is waiting for
+BACKGROUND = "background"  # memory updates and other deferred work
+
+# One HTTP client (connection pool with keep-alive) shared by every thread in the process
+_client = FakeChatClient() if LLM_BACKEND == "fake" else ollama.Client(host=OLLAMA_HOST)
+# Async clients are bound to the event loop they were first used on
+_async_clients = weakref.WeakKeyDictionary()
+
+# Slots are shared by sync and async callers: each waiter is a grant callback, oldest first
+_slots_lock = threading.Lock()
+_in_flight = {INTERACTIVE: 0, BACKGROUND: 0}
+_waiters = {INTERACTIVE: deque(), BACKGROUND: deque()}
+_metrics = {
+    priority: {"requests": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0}
+    for priority in (INTERACTIVE, BACKGROUND)
+}
+
+def _can_start(priority: str) -> bool:
+    if sum(_in_flight.values()) >= LLM_MAX_CONCURRENCY:
+        return False
+    if priority == BACKGROUND:
+        # Background work yields to waiting answers and never takes the last free slot
+        return not _waiters[INTERACTIVE] and _in_flight[BACKGROUND] < LLM_BACKGROUND_MAX_CONCURRENCY
+    return True
+
+def _grant_waiters():
+    """Hands free slots to the oldest waiters, interactive first (_slots_lock held)."""
+    for priority in (INTERACTIVE, BACKGROUND):
+        while _waiters[priority] and _can_start(priority):
+            grant = _waiters[priority].popleft()
+            _in_flight[priority] += 1
+            try:
+                grant()
+            except RuntimeError:
+                # The waiter's event loop is already closed
+                _in_flight[priority] -= 1
+
+def _try_acquire(priority: str, grant) -> bool:
+    """Takes a slot right away if possible, otherwise queues grant to be called when one is handed over."""
+    if priority not in _in_flight:
+        raise ValueError(f"Unknown LLM priority: {priority}")
+    with _slots_lock:
+        if not _waiters[priority] and _can_start(priority):
+            _in_flight[priority] += 1
+            return True
+        _waiters[priority].append(grant)
+        return False
+
+def _record_wait(priority: str, queued: float) -> float:
+    wait_seconds = time.monotonic() - queued
+    with _slots_lock:
+        metrics = _metrics[priority]
+        metrics["requests"] += 1
+        metrics["total_wait_seconds"] += wait_seconds
+        metrics["max_wait_seconds"] = max(metrics["max_wait_seconds"], wait_seconds)
+    if wait_seconds > 1:
+        verbose(f"{priority} LLM request waited {wait_seconds:.2f}s for a slot")
+    return wait_seconds
+
+def _release(priority: str):
+    with _slots_lock:
+        _in_flight[priority] -= 1
+        _grant_waiters()
+
+@contextmanager
+def _llm_slot(priority: str):
+    """Holds one of the LLM_MAX_CONCURRENCY request slots for the duration of the block; yields the seconds waited."""
+    queued = time.monotonic()
+    granted = threading.Event()
+    if not _try_acquire(priority, granted.set):
+        granted.wait()
+    wait_seconds = _record_wait(priority, queued)
+    try:
+        yield wait_seconds
+    finally:
+        _release(priority)
+
+@asynccontextmanager
+async def _async_llm_slot(priority: str):
+    """Same as _llm_slot, but waits without blocking the event loop."""
+    queued = time.monotonic()
+    loop = asyncio.get_running_loop()
+    granted = loop.create_future()
+
+    def grant():
+        loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+    if not _try_acquire(priority, grant):
+        try:
+            await granted
+        except asyncio.CancelledError:
+            with _slots_lock:
+                if grant in _waiters[priority]:
+                    _waiters[priority].remove(grant)
+                    was_granted = False
+                else:
+                    was_granted = True
+            if was_granted:
+                _release(priority)
+            raise
+    wait_seconds = _record_wait(priority, queued)
+    try:
+        yield wait_seconds
+    finally:
+        _release(priority)
+
+def _get_async_client() -> ollama.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = FakeAsyncChatClient() if LLM_BACKEND == "fake" else ollama.AsyncClient(host=OLLAMA_HOST)
+        _async_clients[loop] = client
+    return client
+
+def _token_counts(response) -> dict:
+    """Prompt and completion token counts reported by the server (on the final chunk of a stream)."""
+    return {
+        "prompt_tokens": response.get("prompt_eval_count") or 0,
+        "completion_tokens": response.get("eval_count") or 0,
+    }
+
+def chat(messages: list, priority: str = INTERACTIVE, format: str | None = None) -> str:
+    """Returns the model's reply to messages (format="json" constrains the output to valid JSON)."""
+    with span("llm.call", priority=priority, stream=False) as s, _llm_slot(priority) as wait_seconds:
+        response = _client.chat(model=OLLAMA_MODEL, messages=messages, format=format, keep_alive=OLLAMA_KEEP_ALIVE)
+        s.set(slot_wait_seconds=wait_seconds, **_token_counts(response))
+    return response['message']['content']
+
+def stream_chat(messages: list, priority: str = INTERACTIVE):
+    """Yields the model's reply in chunks; the slot is held until the stream ends or is closed."""
+    with span("llm.call", priority=priority, stream=True) as s, _llm_slot(priority) as wait_seconds:
+        s.set(slot_wait_seconds=wait_seconds)
+        started = time.perf_counter()
+        first_chunk = True
+        for chunk in _client.chat(model=OLLAMA_MODEL, messages=messages, stream=True, keep_alive=OLLAMA_KEEP_ALIVE):
+            if chunk.get("done"):
+                s.set(**_token_counts(chunk))
+            content = chunk['message']['content']
+            if content:
+                if first_chunk:
+                    s.set(first_chunk_seconds=time.perf_counter() - started)
+                    first_chunk = False
+                yield content
+
+async def achat(messages: list, priority: str = INTERACTIVE, format: str | None = None) -> str:
+    """Async chat() on ollama.AsyncClient."""
+    with span("llm.call", priority=priority, stream=False) as s:
+        async with _async_llm_slot(priority) as wait_seconds:
+            response = await _get_async_client().chat(
+                model=OLLAMA_MODEL, messages=messages, format=format, keep_alive=OLLAMA_KEEP_ALIVE
+            )
+            s.set(slot_wait_seconds=wait_seconds, **_token_counts(response))
+    return response['message']['content']
+
+async def astream_chat(messages: list, priority: str = INTERACTIVE):
+    """Async stream_chat() on ollama.AsyncClient."""
+    with span("llm.call", priority=priority, stream=True) as s:
+        async with _async_llm_slot(priority) as wait_seconds:
+            s.set(slot_wait_seconds=wait_seconds)
+            started = time.perf_counter()
+            first_chunk = True
+            stream = await _get_async_client().chat(
+                model=OLLAMA_MODEL, messages=messages, stream=True, keep_alive=OLLAMA_KEEP_ALIVE
+            )
+            async for chunk in stream:
+                if chunk.get("done"):
+                    s.set(**_token_counts(chunk))
+                content = chunk['message']['content']
+                if content:
+                    if first_chunk:
+                        s.set(first_chunk_seconds=time.perf_counter() - started)
+                        first_chunk = False
+                    yield content
+
+def get_llm_metrics() -> dict:
+    """Returns current queue depth and in-flight requests, plus request counts and slot wait times, per priority."""
+    with _slots_lock:
+        return {
+            priority: {
+                "waiting": len(_waiters[priority]),
+                "in_flight": _in_flight[priority],
+                "requests": metrics["requests"],
+                "avg_wait_seconds": metrics["total_wait_seconds"] / metrics["requests"] if metrics["requests"] else 0.0,
+                "max_wait_seconds": metrics["max_wait_seconds"],
+            }
+            for priority, metrics in _metrics.items()
+        }
@@ -0,0 +1,155 @@
+from utils.prompt_manager import prepare_summary_prompt, prepare_combined_summary_prompt
+from utils.sql_manager import (
+    save_chat_responses,
+    get_chat_summary_record,
+    save_chat_summary_record,
+    compact_user_records
+)
+from utils.response_manager import get_llm_response
+from utils.llm_client import BACKGROUND
+from utils.vectorstore_manager import update_vector_store
+from utils.job_queue import enqueue_job, register_job_handler
+from utils.tracing import verbose, span
+
+import os
+import json
+from dotenv import load_dotenv
+load_dotenv()
+
+# Configuration
+COMBINED_SUMMARY = os.getenv("COMBINED_SUMMARY", "true").lower() == "true"
+MEMORY_UPDATE_QUIET_SECONDS = float(os.getenv("MEMORY_UPDATE_QUIET_SECONDS", 5))
+MEMORY_UPDATE_MAX_TURNS = int(os.getenv("MEMORY_UPDATE_MAX_TURNS", 5))
+
+MEMORY_UPDATE_JOB = "memory_update"
+
+def parse_combined_summary(text: str) -> tuple[str, str] | None:
+    """Returns (user_summary, general_summary) from a combined summary response, or None if it is malformed."""
+    try:
+        data = json.loads(text)
+        user_summary = data["user_summary"]
+        general_summary = data["general_summary"]
+    except (ValueError, TypeError, KeyError):
+        return None
+    if not isinstance(user_summary, str) or not isinstance(general_summary, str):
+        return None
+    if not user_summary.strip() or not general_summary.strip():
+        return None
+    return user_summary.strip(), general_summary.strip()
+
+def get_turn_summaries(last_summary, turns: list) -> tuple[str, str]:
+    """
+    Returns the user summary and the general (PII-free) summary of one or more (question, answer) turns.
+    With COMBINED_SUMMARY both come from one structured LLM call, falling back to
+    one call per summary if the combined response cannot be parsed.
+    """
+    *earlier_turns, (question, response) = turns
+
+    if COMBINED_SUMMARY:
+        combined_prompt = prepare_combined_summary_prompt(
+            previous_summary=last_summary,
+            question=question,
+            answer=response,
+            earlier_turns=earlier_turns
+        )
+        summaries = parse_combined_summary(get_llm_response(
+            prompt=combined_prompt,
+            question=None,
+            format="json",
+            priority=BACKGROUND
+        ))
+        if summaries:
+            return summaries
+        verbose("⚠️ Could not parse combined summary response. Falling back to separate summaries.")
+
+    summaries = []
+    for summary_type in ("user", "general"):
+        # Prepare summary prompt in user/general perspective based on previous summary
+        summary_prompt = prepare_summary_prompt(
+            previous_summary=last_summary,
+            question=question,
+            answer=response,
+            type=summary_type,
+            earlier_turns=earlier_turns
+        )
+
+        # Get summary of recent chat
+        summaries.append(get_llm_response(
+            prompt=summary_prompt,
+            question=None,
+            priority=BACKGROUND
+        ))
+    return summaries[0], summaries[1]
+
+def update_databases(turns: list, user_id: str, covered_until: str | None = None):
+    """
+    Refreshes the chat summaries and vector stores after one or more (question, answer) turns.
+    All turns go into a single summary and a single knowledge store write.
+    covered_until is the chat_history timestamp of the newest turn (see get_older_chat_summaries).
+    """
+    with span("memory.update", user_id=user_id, turns=len(turns)):
+        # Build on the latest saved summary (it may be newer than when the turns were queued)
+        previous_chat_summary = get_chat_summary_record(user_id)
+        last_summary = previous_chat_summary[-1] if previous_chat_summary else None
+        new_summary, general_summary = get_turn_summaries(last_summary, turns)
+
+        # Update knowledge store with new summary first: it waits for the write to reach disk,
+        # and if that fails the job is retried before anything else of this update is saved
+        update_vector_store(
+            new_summary=general_summary,
+            user_id=None
+        )
+
+        # Save summary into database
+        save_chat_summary_record(
+            chat_summary=new_summary,
+            user_id=user_id,
+            covered_until=covered_until
+        )
+
+        # Trim records past retention, moving old summaries to the user vector store.
+        # Its own step: the summaries above are already saved, so a failure here must not retry the
+        # job (that would write them again); compaction is idempotent and reruns on the next update
+        try:
+            compact_user_records(user_id)
+        except Exception as e:
+            verbose(f"⚠️ Compacting records for user {user_id} failed, retrying on the next update: {e}")
+
+def enqueue_memory_update(question, response, user_id):
+    """
+    Saves a finished turn and queues update_databases for it on the persistent background job queue.
+    The chat itself is saved right away so the next turn sees it and job retries never duplicate it.
+    Turns a user sends in quick succession are coalesced into one update (see MEMORY_UPDATE_QUIET_SECONDS).
+    """
+    # Save recent chat to database
+    timestamp = save_chat_responses(question, response, user_id)
+
+    try:
+        enqueue_job(
+            kind=MEMORY_UPDATE_JOB,
+            user_id=user_id,
+            payload={
+                "question": question,
+                "response": response,
+                "timestamp": timestamp
+            }
+        )
+    except RuntimeError as e:
+        verbose(f"⚠️ Memory update for user {user_id} was dropped: {e}")
+
+def process_memory_update_job(user_id, payloads):
+    verbose(f"Updating memory for user {user_id} with {len(payloads)} coalesced turn(s)")
+    # Jobs queued before turns carried their timestamp fall back to the summary's own time
+    timestamps = [payload["timestamp"] for payload in payloads if payload.get("timestamp")]
+    update_databases(
+        turns=[(payload["question"], payload["response"]) for payload in payloads],
+        user_id=user_id,
+        covered_until=max(timestamps) if timestamps else None
+    )
+
+register_job_handler(
+    MEMORY_UPDATE_JOB,
+    process_memory_update_job,
+    quiet_seconds=MEMORY_UPDATE_QUIET_SECONDS,
+    max_batch=MEMORY_UPDATE_MAX_TURNS
+)
@@ -0,0 +1,114 @@
+import numpy as np
+
+from utils.faiss_persistence import (
+    read_generation,
+    get_snapshot_path,
+    get_log_paths,
+    read_log_lines
+)
+
+import os
+import threading
+
+def _memmap(file_path: str, dtype, shape=None):
+    # np.memmap cannot map an empty file
+    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        return np.zeros(0 if shape is None else shape, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode="r", shape=shape)
+
+def top_k_by_distance(distances: np.ndarray, k: int) -> np.ndarray:
+    """Returns the indexes of the k smallest distances, closest first."""
+    if len(distances) <= k:
+        return np.argsort(distances)
+    candidates = np.argpartition(distances, k)[:k]
+    return candidates[np.argsort(distances[candidates])]
+
+def squared_l2_distances(matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Squared L2 distance from query to every row, matching FAISS IndexFlatL2 scores."""
+    return np.einsum("ij,ij->i", matrix, matrix) - 2 * (matrix @ query) + query @ query
+
+class MmapVectorStore:
+    """
+    Read-only view of a FAISS store on disk (see utils/faiss_persistence.py) that memory-maps
+    the flat snapshot vectors and texts instead of deserializing a private copy of the index,
+    so every process on the machine shares the same pages through the OS cache.
+    Vectors appended since the snapshot are read from the append-only log.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.generation = None
+        self._lock = threading.Lock()
+
+    def is_supported(self) -> bool:
+        """False for stores whose snapshot predates the flat file export (legacy save_local stores)."""
+        generation = read_generation(self.path)
+        snapshot_dir = get_snapshot_path(self.path, generation)
+        has_index = os.path.exists(os.path.join(snapshot_dir, "index.faiss"))
+        has_flat = os.path.exists(os.path.join(snapshot_dir, "vectors.f32"))
+        return has_flat or not has_index
+
+    def _open_snapshot(self, generation: int):
+        snapshot_dir = get_snapshot_path(self.path, generation)
+        self.offsets = _memmap(os.path.join(snapshot_dir, "offsets.u64"), np.uint64)
+        self.texts = _memmap(os.path.join(snapshot_dir, "texts.bin"), np.uint8)
+        count = max(len(self.offsets) - 1, 0)
+        vectors = _memmap(os.path.join(snapshot_dir, "vectors.f32"), np.float32)
+        self.dim = len(vectors) // count if count else None
+        self.vectors = vectors.reshape(count, self.dim) if count else None
+
+        self.generation = generation
+        self.log_texts = []
+        self.log_end = 0
+        self.log_vectors = None
+
+    def _refresh(self):
+        """Reopens the snapshot after a compaction and picks up newly appended log entries."""
+        generation = read_generation(self.path)
+        if generation != self.generation:
+            self._open_snapshot(generation)
+
+        segments_path, docstore_path = get_log_paths(self.path, generation)
+        entries, line_ends = read_log_lines(docstore_path, start=self.log_end)
+        if entries:
+            self.dim = self.dim or entries[0]["dim"]
+            self.log_texts.extend(entry["text"] for entry in entries)
+            self.log_end = line_ends[-1]
+        if self.log_texts:
+            count = min(len(self.log_texts), os.path.getsize(segments_path) // (4 * self.dim))
+            self.log_vectors = _memmap(segments_path, np.float32, shape=(count, self.dim))
+
+    def _snapshot_text(self, i: int) -> str:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return bytes(self.texts[start:end]).decode("utf-8")
+
+    def similarity_search_with_score_by_vector(self, query_embedding: list, k: int = 4) -> list:
+        """Returns up to k (text, score) pairs, lower scores being closer matches."""
+        with self._lock:
+            self._refresh()
+            parts = [(m, source) for m, source in ((self.vectors, "snapshot"), (self.log_vectors, "log")) if m is not None and len(m)]
+            if not parts:
+                return []
+
+            query = np.asarray(query_embedding, dtype=np.float32)
+            results = []
+            for matrix, source in parts:
+                distances = squared_l2_distances(matrix, query)
+                for i in top_k_by_distance(distances, k):
+                    text = self._snapshot_text(i) if source == "snapshot" else self.log_texts[i]
+                    results.append((text, float(distances[i])))
+
+        results.sort(key=lambda pair: pair[1])
+        return results[:k]
+
+_mmap_stores = {}
+_mmap_stores_lock = threading.Lock()
+
+def get_mmap_store(path: str) -> MmapVectorStore | None:
+    """Returns the shared read-only view of the store at path, or None if it cannot be memory-mapped."""
+    with _mmap_stores_lock:
+        store = _mmap_stores.get(path)
+        if store is None:
+            store = MmapVectorStore(path)
+            _mmap_stores[path] = store
+    return store if store.is_supported() else None
@@ -0,0 +1,117 @@
+import numpy as np
+
+from utils.mmap_store import top_k_by_distance
+
+import os
+import json
+
+# Exact-search format for small stores (a few dozen to a few thousand vectors).
+#
+# <store>/vectors.npy        n x dim float32 embeddings, loaded with mmap_mode="r"
+# <store>/docstore.jsonl     one JSON line per vector: {"id", "text", "metadata"}
+#
+# Small stores are rewritten in full on every flush (each file is written to a temp file
+# and atomically replaced). Vectors are written first, so a crash between the two files
+# leaves extra vectors that are ignored on load.
+
+def numpy_store_exists(path: str) -> bool:
+    return os.path.exists(os.path.join(path, "vectors.npy"))
+
+def _replace_file(file_path: str, write):
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+class NumpyVectorStore:
+    """
+    In-memory vector store searched with a single matrix product, for stores too small to be
+    worth a FAISS index. Scores are cosine distances (1 - cosine similarity), lower being closer.
+    """
+
+    def __init__(self, vectors: np.ndarray | None = None, texts: list | None = None,
+                 ids: list | None = None, metadatas: list | None = None):
+        self.vectors = vectors
+        self.texts = texts or []
+        self.ids = ids or []
+        self.metadatas = metadatas or []
+        self._unit_vectors = None
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def add_embeddings(self, text_embeddings: list, metadatas: list | None = None, ids: list | None = None):
+        """Same signature as FAISS.add_embeddings."""
+        new_vectors = np.asarray([vector for _, vector in text_embeddings], dtype=np.float32)
+        self.vectors = new_vectors if self.vectors is None else np.vstack([self.vectors, new_vectors])
+        self.texts.extend(text for text, _ in text_embeddings)
+        self.ids.extend(ids or [None] * len(text_embeddings))
+        self.metadatas.extend(metadatas or [{}] * len(text_embeddings))
+        self._unit_vectors = None
+
+    def _get_unit_vectors(self) -> np.ndarray:
+        # Normalized once per change so each search is a single matrix product
+        if self._unit_vectors is None:
+            norms = np.linalg.norm(self.vectors, axis=1, keepdims=True)
+            self._unit_vectors = self.vectors / np.maximum(norms, 1e-12)
+        return self._unit_vectors
+
+    def similarity_search_with_score_by_vectors(self, query_embeddings: list, k: int = 4) -> list:
+        """Searches a batch of queries at once. Returns one [(text, score), ...] list per query, closest first."""
+        if not len(self):
+            return [[] for _ in query_embeddings]
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        distances = 1.0 - queries @ self._get_unit_vectors().T
+
+        results = []
+        for row in distances:
+            results.append([(self.texts[i], float(row[i])) for i in top_k_by_distance(row, k)])
+        return results
+
+    def similarity_search_with_score_by_vector(self, query_embedding: list, k: int = 4) -> list:
+        """Returns up to k (text, score) pairs, lower scores being closer matches."""
+        return self.similarity_search_with_score_by_vectors([query_embedding], k)[0]
+
+    def save(self, path: str):
+        """Rewrites the store on disk."""
+        os.makedirs(path, exist_ok=True)
+        vectors = np.ascontiguousarray(self.vectors, dtype=np.float32)
+        _replace_file(os.path.join(path, "vectors.npy"), lambda f: np.save(f, vectors))
+
+        lines = "".join(
+            json.dumps({"id": doc_id, "text": text, "metadata": metadata}) + "\n"
+            for doc_id, text, metadata in zip(self.ids, self.texts, self.metadatas)
+        )
+        _replace_file(os.path.join(path, "docstore.jsonl"), lambda f: f.write(lines.encode("utf-8")))
+
+def load_numpy_store(path: str) -> NumpyVectorStore | None:
+    """Loads the store at path with its vectors memory-mapped. Returns None if there is no store."""
+    if not numpy_store_exists(path):
+        return None
+
+    vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+    entries = []
+    docstore_path = os.path.join(path, "docstore.jsonl")
+    if os.path.exists(docstore_path):
+        with open(docstore_path, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+
+    count = min(len(vectors), len(entries))
+    entries = entries[:count]
+    return NumpyVectorStore(
+        vectors=vectors[:count],
+        texts=[entry["text"] for entry in entries],
+        ids=[entry["id"] for entry in entries],
+        metadatas=[entry["metadata"] for entry in entries]
+    )
+
+def remove_numpy_store(path: str):
+    """Deletes the exact-search files once a store has moved to FAISS."""
+    for name in ("vectors.npy", "docstore.jsonl"):
+        file_path = os.path.join(path, name)
+        if os.path.exists(file_path):
+            os.remove(file_path)
@@ -15,7 +15,13 @@ def prepare_vectordb_search_prompt(user_question: str) -> str:
     )
     return prompt
 
-def prepare_summary_prompt(previous_summary: str, question: str, answer: str, type: str) -> str:
+def format_conversation(question: str, answer: str, earlier_turns: list | None = None) -> str:
+    """Render the turns of a conversation, oldest first, ending with the given question and answer."""
+    turns = list(earlier_turns or []) + [(question, answer)]
+    return "".join(f"User: {q}\nAssistant: {a}\n" for q, a in turns)
+
+def prepare_summary_prompt(previous_summary: str, question: str, answer: str, type: str,
+                           earlier_turns: list | None = None) -> str:
     """
     Prepare a prompt to summarize a chat conversation between user and LLM.
     The prompt instructs the model to return strictly the summary text.
@@ -25,6 +31,7 @@ def prepare_summary_prompt(previous_summary: str, question: str, answer: str, ty
         question (str): User's message.
         answer (str): Assistant's response.
         type (str): 'user' for user-facing summary, else general summary removing PII.
+        earlier_turns (list): Optional (question, answer) turns preceding this one, oldest first.
 
     Returns:
         str: The prompt text to use for generating a summary.
@@ -35,7 +42,7 @@ def prepare_summary_prompt(previous_summary: str, question: str, answer: str, ty
     if previous_summary:
         prompt += f"Previous summary:\n{previous_summary}\n\n"
     
-    prompt += f"Conversation:\nUser: {question}\nAssistant: {answer}\n\n"
+    prompt += f"Conversation:\n{format_conversation(question, answer, earlier_turns)}\n"
     
     if type == "user":
         prompt += "Provide a concise summary including all important details. Respond **only** with the summary text."
@@ -43,4 +50,37 @@ def prepare_summary_prompt(previous_summary: str, question: str, answer: str, ty
         prompt += ("Provide a concise summary including important details, but remove any personally identifiable "
                    "information (PII) or user-specific data. Respond **only** with the summary text.")
     
-    return prompt
\ No newline at end of file
+    return prompt
+
+def prepare_combined_summary_prompt(previous_summary: str, question: str, answer: str,
+                                    earlier_turns: list | None = None) -> str:
+    """
+    Prepare a prompt that asks for both the user summary and the general (PII-free) summary
+    of a chat conversation in a single structured response.
+
+    Args:
+        previous_summary (str): Optional previous summary to include.
+        question (str): User's message.
+        answer (str): Assistant's response.
+        earlier_turns (list): Optional (question, answer) turns preceding this one, oldest first.
+
+    Returns:
+        str: The prompt text; the model must answer with a JSON object holding
+             "user_summary" and "general_summary".
+    """
+    
+    prompt = "Summarize the following conversation, preserving key details and the conversation's tone:\n\n"
+    
+    if previous_summary:
+        prompt += f"Previous summary:\n{previous_summary}\n\n"
+    
+    prompt += f"Conversation:\n{format_conversation(question, answer, earlier_turns)}\n"
+    
+    prompt += ("Write two concise summaries:\n"
+               "1. user_summary: includes all important details.\n"
+               "2. general_summary: includes important details, but removes any personally identifiable "
+               "information (PII) or user-specific data.\n\n"
+               "Respond **only** with a JSON object of the form "
+               '{"user_summary": "...", "general_summary": "..."}.')
+    
+    return prompt
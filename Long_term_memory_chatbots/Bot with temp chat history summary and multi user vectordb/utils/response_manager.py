@@ -1,35 +1,38 @@
-import ollama
-
-import os
-from dotenv import load_dotenv
-load_dotenv()
-
-# Configuration
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL")
-
-def get_older_summaries(chat_history: list | None, previous_chat_summary: list | None) -> list:
-    """
-    Returns chat summaries that do not have corresponding chat history entries.
-    Safe to call even if both inputs are empty or None.
-    Both lists must be in ascending time order (oldest → newest).
-    """
-    if not previous_chat_summary:
-        return []
-    if not chat_history:
-        return previous_chat_summary
-
-    extra_count = len(previous_chat_summary) - len(chat_history)
-    return previous_chat_summary[:extra_count] if extra_count > 0 else []
+from utils.llm_client import chat, stream_chat, achat, astream_chat, INTERACTIVE
+from utils.tracing import verbose
 
 def summarize_within_token_limit(
     data,
     remaining_tokens: int,
-    question: str
+    question: str,
+    priority: str = INTERACTIVE
 ) -> str:
     """
     Summarizes given data strictly within the remaining token budget.
     Returns only the summary text — no extra explanations, headings, or formatting.
     """
+    prompt = prepare_token_limited_summary_prompt(data, remaining_tokens, question)
+
+    # This uses your existing get_llm_response() definition
+    summary = get_llm_response(prompt, question, priority=priority)
+    verbose("Generated response from LLM (used for summarization)")
+
+    return summary.strip()
+
+async def asummarize_within_token_limit(
+    data,
+    remaining_tokens: int,
+    question: str,
+    priority: str = INTERACTIVE
+) -> str:
+    """Async summarize_within_token_limit()."""
+    prompt = prepare_token_limited_summary_prompt(data, remaining_tokens, question)
+    summary = await aget_llm_response(prompt, question, priority=priority)
+    verbose("Generated response from LLM (used for summarization)")
+
+    return summary.strip()
+
+def prepare_token_limited_summary_prompt(data, remaining_tokens: int, question: str) -> str:
     if isinstance(data, list):
         content = "\n".join(str(item) for item in data)
     else:
@@ -45,12 +48,7 @@ def summarize_within_token_limit(
         f"User question (for context): {question}\n\n"
         f"Data:\n{content}"
     )
-
-    # This uses your existing get_llm_response() definition
-    summary = get_llm_response(prompt, question)
-    print("VERBOSE: Generated response from LLM (used for summarization)")
-
-    return summary.strip()
+    return prompt
 
 def build_messageslist(prompt: str, question: str) -> list:
     # Function to build messages that are passed on to LLM
@@ -68,14 +66,30 @@ def prepare_basic_chat_system_prompt() -> str:
     return """You are a professional assistant. Your job is to answer user questions but in a brief manner within 100 words 
     such that no important information isn't left out and you will receive a user query."""
 
-def get_llm_response(prompt: str, question: str) -> str:
+def get_llm_response(prompt: str, question: str, format: str | None = None, priority: str = INTERACTIVE) -> str:
     # Get messages to pass into LLM
     messages = build_messageslist(prompt, question)
     
-    # Get response from LLM
-    response = ollama.chat(model=OLLAMA_MODEL, messages=messages)
+    # Get response from LLM (format="json" constrains the output to valid JSON)
+    # priority is INTERACTIVE or BACKGROUND, see utils/llm_client.py
+    return chat(messages, priority=priority, format=format)
+
+def stream_llm_response(prompt: str, question: str, priority: str = INTERACTIVE):
+    """Yields the LLM response in chunks as they are generated."""
+    messages = build_messageslist(prompt, question)
     
-    return response['message']['content']
+    yield from stream_chat(messages, priority=priority)
+
+async def aget_llm_response(prompt: str, question: str, format: str | None = None, priority: str = INTERACTIVE) -> str:
+    """Async get_llm_response() on ollama.AsyncClient."""
+    messages = build_messageslist(prompt, question)
+    return await achat(messages, priority=priority, format=format)
+
+async def astream_llm_response(prompt: str, question: str, priority: str = INTERACTIVE):
+    """Async stream_llm_response() on ollama.AsyncClient."""
+    messages = build_messageslist(prompt, question)
+    async for content in astream_chat(messages, priority=priority):
+        yield content
     
 # def prepare_chat_system_prompt(general_vectordb_results, user_vectordb_results, chat_summary) -> str:
 #     # Function to return prompt for chat conversations
@@ -96,6 +110,6 @@ def get_llm_response(prompt: str, question: str) -> str:
 #         prompt += f"""Here are the summaries of the last {len(chat_summary)} conversations sorted by time in ascending order
 #         in a tuple:\n{chat_summary}"""
         
-#     print(f"VERBOSE: Prepared chat system prompt")
+#     verbose(f"Prepared chat system prompt")
     
 #     return prompt
\ No newline at end of file
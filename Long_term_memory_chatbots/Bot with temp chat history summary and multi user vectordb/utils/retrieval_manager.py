@@ -0,0 +1,122 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import time
+import asyncio
+import contextvars
+
+from utils.sql_manager import get_chat_history, get_older_chat_summaries
+from utils.vectorstore_manager import search_vector_stores
+from utils.tracing import verbose, span
+
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# Configuration
+RETRIEVAL_MAX_WORKERS = int(os.getenv("RETRIEVAL_MAX_WORKERS", 8))
+RETRIEVAL_DB_WORKERS = int(os.getenv("RETRIEVAL_DB_WORKERS", 4))
+RETRIEVAL_TIMEOUT_SECONDS = float(os.getenv("RETRIEVAL_TIMEOUT_SECONDS", 5))
+VECTORDB_TIMEOUT_SECONDS = float(os.getenv("VECTORDB_TIMEOUT_SECONDS", RETRIEVAL_TIMEOUT_SECONDS))
+
+# Bounded pools shared by every chat session in the process: one for the embedding call and vector
+# searches, and one for the SQLite reads, so millisecond reads never queue behind a slow embedding
+_retrieval_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_MAX_WORKERS,
+    thread_name_prefix="retrieval"
+)
+_db_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_DB_WORKERS,
+    thread_name_prefix="retrieval-db"
+)
+
+def _submit(func, executor: ThreadPoolExecutor = _retrieval_executor):
+    """Runs func on executor in a copy of the caller's context, so its spans keep the turn id."""
+    return executor.submit(contextvars.copy_context().run, func)
+
+def gather_sources(sources: dict) -> dict:
+    """
+    Runs independent retrieval sources concurrently on the shared executors.
+    sources maps a name to (callable, timeout_seconds, default, executor).
+    A source that fails or does not finish within its timeout (measured from the
+    start of the stage) yields its default instead of blocking the turn.
+    """
+    start = time.monotonic()
+    futures = {
+        name: _submit(func, executor)
+        for name, (func, _, _, executor) in sources.items()
+    }
+
+    results = {}
+    with span("retrieval", sources=len(sources)) as s:
+        for name, (_, timeout, default, _) in sources.items():
+            remaining = max(start + timeout - time.monotonic(), 0)
+            try:
+                results[name] = futures[name].result(timeout=remaining)
+            except TimeoutError:
+                verbose(f"⚠️ Retrieval source '{name}' timed out after {timeout}s. Skipping it.")
+                results[name] = default
+            except Exception as e:
+                verbose(f"⚠️ Retrieval source '{name}' failed: {e}. Skipping it.")
+                results[name] = default
+        s.set(skipped=[name for name, (_, _, default, _) in sources.items() if results[name] is default])
+
+    verbose(f"Retrieval stage finished in {time.monotonic() - start:.2f}s")
+    return results
+
+async def agather_sources(sources: dict) -> dict:
+    """
+    Async gather_sources(): the sources still run on the shared executors (SQLite and FAISS
+    calls are blocking), but the caller awaits them without holding up its event loop.
+    """
+    start = time.monotonic()
+    futures = {
+        name: asyncio.wrap_future(_submit(func, executor))
+        for name, (func, _, _, executor) in sources.items()
+    }
+
+    results = {}
+    with span("retrieval", sources=len(sources)) as s:
+        for name, (_, timeout, default, _) in sources.items():
+            remaining = max(start + timeout - time.monotonic(), 0)
+            try:
+                # shield: a timed out source keeps running on the executor instead of being cancelled
+                results[name] = await asyncio.wait_for(asyncio.shield(futures[name]), remaining)
+            except asyncio.TimeoutError:
+                verbose(f"⚠️ Retrieval source '{name}' timed out after {timeout}s. Skipping it.")
+                results[name] = default
+            except Exception as e:
+                verbose(f"⚠️ Retrieval source '{name}' failed: {e}. Skipping it.")
+                results[name] = default
+        s.set(skipped=[name for name, (_, _, default, _) in sources.items() if results[name] is default])
+
+    verbose(f"Retrieval stage finished in {time.monotonic() - start:.2f}s")
+    return results
+
+def _resource_sources(question: str, user_id: str) -> dict:
+    """Retrieval sources of a turn for gather_sources / agather_sources."""
+
+    def search_stores():
+        # One task embeds the query once and searches both stores with it, instead of one pool thread
+        # per store waiting on the embedding; nothing is embedded when neither store exists yet
+        results = search_vector_stores(user_question=question, user_ids=[user_id, None])
+        return tuple([text for text, _ in results[store_user_id] or []] for store_user_id in (user_id, None))
+
+    return {
+        "chat_history": (lambda: get_chat_history(user_id), RETRIEVAL_TIMEOUT_SECONDS, [], _db_executor),
+        "chat_summary": (lambda: get_older_chat_summaries(user_id), RETRIEVAL_TIMEOUT_SECONDS, [], _db_executor),
+        "vectordb_results": (search_stores, VECTORDB_TIMEOUT_SECONDS, ([], []), _retrieval_executor),
+    }
+
+def _split_vectordb_results(resources: dict) -> dict:
+    resources["user_vectordb_results"], resources["general_vectordb_results"] = resources.pop("vectordb_results")
+    return resources
+
+def retrieve_resources(question: str, user_id: str) -> dict:
+    """
+    Fetches chat history, chat summaries and user/general vector db results for a turn in parallel.
+    Both vector searches share a single query embedding.
+    """
+    return _split_vectordb_results(gather_sources(_resource_sources(question, user_id)))
+
+async def aretrieve_resources(question: str, user_id: str) -> dict:
+    """Async retrieve_resources()."""
+    return _split_vectordb_results(await agather_sources(_resource_sources(question, user_id)))
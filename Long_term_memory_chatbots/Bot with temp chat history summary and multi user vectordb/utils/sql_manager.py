@@ -1,8 +1,11 @@
 import os
+import queue
 import sqlite3
 import datetime
+from contextlib import contextmanager
 
-from utils.vectorstore_manager import update_vector_store
+from utils.vectorstore_manager import add_summaries_to_vector_store, flush_vector_store, get_store_path
+from utils.tracing import verbose, span
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -10,138 +13,245 @@ load_dotenv()
 # Configuration
 chats_tobesaved = os.getenv("SAVED_CHAT_CONVO")
 summaries_tobesaved = os.getenv("SAVED_CHAT_SUMMARIES")
+DB_NAME = os.getenv("TEMP_MEMORY_DB_NAME")
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", 8))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 16384))
 
-def delete_row(user_id: str, timestamp: str, table_name: str):
-    """Deletes a row from table"""
-    conn = getconnobject()
-    cursor = conn.cursor()
-    
-    query = f"DELETE FROM {table_name} WHERE user_id = ? AND timestamp = ?"
-    cursor.execute(query, (user_id, timestamp))
+# Schema migrations, applied in order by init_db and tracked with PRAGMA user_version
+SCHEMA_MIGRATIONS = [
+    # 1: (user_id, timestamp) indexes so per-user reads stay flat as tables grow
+    """
+    CREATE INDEX IF NOT EXISTS idx_chat_history_user_timestamp ON chat_history (user_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_chat_summary_user_timestamp ON chat_summary (user_id, timestamp);
+    """,
+    # 2: persistent queue for background memory updates (see utils/job_queue.py)
+    """
+    CREATE TABLE IF NOT EXISTS memory_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_memory_jobs_status_user ON memory_jobs (status, user_id, id);
+    """,
+    # 3: timestamp of the newest chat turn each summary covers (one summary can cover several coalesced turns);
+    # existing rows are taken to cover the history saved up to when they were written
+    """
+    ALTER TABLE chat_summary ADD COLUMN covered_until TEXT;
+    UPDATE chat_summary SET covered_until = COALESCE(
+        (SELECT MAX(h.timestamp) FROM chat_history h
+         WHERE h.user_id = chat_summary.user_id AND h.timestamp <= chat_summary.timestamp),
+        timestamp
+    );
+    """,
+    # 4: earliest time a failed job may be retried (exponential backoff, see utils/job_queue.py)
+    """
+    ALTER TABLE memory_jobs ADD COLUMN next_attempt_at REAL NOT NULL DEFAULT 0;
+    """,
+]
 
-    conn.commit()
-    print(f"VERBOSE: Deleted row from {table_name} table")
-    
-    conn.close()
+# Idle connections shared by the request threads and background writers
+_connection_pool = queue.LifoQueue(maxsize=SQLITE_POOL_SIZE)
 
 def getconnobject():
-    DB_NAME = os.getenv("TEMP_MEMORY_DB_NAME")
-    db_path = f"data/{DB_NAME}"
-    return sqlite3.connect(db_path)
+    """Opens a new connection tuned for concurrent readers and background writers."""
+    conn = sqlite3.connect(
+        f"data/{DB_NAME}",
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False
+    )
+    # WAL lets readers proceed while a writer holds the lock
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    return conn
+
+@contextmanager
+def get_connection():
+    """
+    Borrows a connection from the pool, opening a new one if the pool is empty.
+    Connections are returned to the pool afterwards, or closed if the pool is already full.
+    """
+    try:
+        conn = _connection_pool.get_nowait()
+    except queue.Empty:
+        conn = getconnobject()
+
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        try:
+            _connection_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
 
 def get_chat_summary_record(user_id: str):
-    """Get chat summaries"""
-    conn = getconnobject()
-    cursor = conn.cursor()
-    #Execute query
-    cursor.execute(
-        "SELECT summary_text, timestamp FROM chat_summary WHERE user_id = ? ORDER BY timestamp ASC",
-        (user_id,)
-    )
-    
-    record = cursor.fetchall()
-    conn.close()
-    print(f"VERBOSE: Fetched all chat summary record")
+    """Get the most recent chat summaries, oldest first"""
+    with span("db.fetch", table="chat_summary") as s, get_connection() as conn:
+        record = conn.execute(
+            "SELECT summary_text FROM chat_summary WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?",
+            (user_id, int(summaries_tobesaved))
+        ).fetchall()
+        s.set(rows=len(record))
+    verbose(f"Fetched recent chat summary record")
     
     # Need to return only the summary text
-    result = [row[0] for row in record]
-    
-    if len(record) > int(summaries_tobesaved): # Check if records exceed threshold
-        update_vector_store(new_summary = record[0][0], # Update the user vector store before deleting the oldest summary record
-                            user_id     = user_id) 
-        delete_row(user_id    = user_id, 
-                   timestamp  = record[0][1], 
-                   table_name = "chat_summary") # delete the oldest record from table
-        
-        return result[1:] # Return the rest
-    else:
-        return result # Return all the records
-
-def save_chat_summary_record(chat_summary: str, user_id: str):
-    """Saves a chat summary to the database."""
-    conn = getconnobject()
-    cursor = conn.cursor()
+    return [row[0] for row in reversed(record)]
+
+def get_older_chat_summaries(user_id: str):
+    """
+    Get the recent chat summaries that end before the oldest turn still in the chat history window,
+    oldest first. Summaries of turns that are still in the window would only repeat them in the prompt.
+    """
+    with span("db.fetch", table="chat_summary") as s, get_connection() as conn:
+        record = conn.execute(
+            """
+            WITH history_window AS (
+                SELECT MIN(timestamp) AS start FROM (
+                    SELECT timestamp FROM chat_history WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?
+                )
+            )
+            SELECT summary_text FROM chat_summary, history_window
+            WHERE user_id = ? AND (history_window.start IS NULL OR covered_until < history_window.start)
+            ORDER BY timestamp DESC LIMIT ?
+            """,
+            (user_id, int(chats_tobesaved), user_id, int(summaries_tobesaved))
+        ).fetchall()
+        s.set(rows=len(record))
+    verbose(f"Fetched older chat summary record")
+
+    return [row[0] for row in reversed(record)]
+
+def save_chat_summary_record(chat_summary: str, user_id: str, covered_until: str | None = None):
+    """
+    Saves a chat summary to the database.
+    covered_until is the timestamp of the newest chat turn it summarizes (defaults to now).
+    """
     timestamp = datetime.datetime.now().isoformat()
     
-    cursor.execute(
-        "INSERT INTO chat_summary (summary_text, timestamp, user_id) VALUES (?, ?, ?)",
-        (chat_summary, timestamp, user_id)
-    )
-    
-    conn.commit()
-    print(f"VERBOSE: Saved chat summary")
-    
-    conn.close()
+    with span("db.write", table="chat_summary"), get_connection() as conn:
+        conn.execute(
+            "INSERT INTO chat_summary (summary_text, timestamp, user_id, covered_until) VALUES (?, ?, ?, ?)",
+            (chat_summary, timestamp, user_id, covered_until or timestamp)
+        )
+        conn.commit()
+    verbose(f"Saved chat summary")
     
 def get_chat_history(user_id: str):
     """Retrieves recent chat history from the database."""
-    conn = getconnobject()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "SELECT user_message, bot_response, timestamp FROM chat_history WHERE user_id = ? ORDER BY timestamp ASC",
-        (user_id,)
-    )
-    
-    history = cursor.fetchall()
-    conn.close()
-    print(f"VERBOSE: Fetched all chat history if there was any")
+    with span("db.fetch", table="chat_history") as s, get_connection() as conn:
+        history = conn.execute(
+            "SELECT user_message, bot_response FROM chat_history WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?",
+            (user_id, int(chats_tobesaved))
+        ).fetchall()
+        s.set(rows=len(history))
+    verbose(f"Fetched recent chat history if there was any")
     
     # Need to return only the user_message and bot_response
-    result = [(row[0], row[1]) for row in history]
-    
-    if len(history) > int(chats_tobesaved): # Check if records exceed threshold
-        delete_row(user_id    = user_id, 
-                   timestamp  = history[0][2], 
-                   table_name = "chat_history") # delete the oldest record from table
-        return result[1:] # Return the rest
-    else:
-        return result # Return all the records
-
-def save_chat_responses(user_message: str, bot_response: str, user_id: str):
-    """Saves a user message and bot response to the database."""
-    conn = getconnobject()
-    cursor = conn.cursor()
-    
+    return [(row[0], row[1]) for row in reversed(history)]
+
+def compact_user_records(user_id: str):
+    """
+    Trims a user's chat history and chat summaries down to their retention limits.
+    Evicted summaries are moved to the user vector store in a single batch, and written
+    to disk, before all excess rows are deleted in one transaction.
+    """
+    with get_connection() as conn:
+        # LIMIT -1 OFFSET n selects everything older than the newest n rows
+        evicted_history = conn.execute(
+            "SELECT id FROM chat_history WHERE user_id = ? ORDER BY timestamp DESC LIMIT -1 OFFSET ?",
+            (user_id, int(chats_tobesaved))
+        ).fetchall()
+        evicted_summaries = conn.execute(
+            "SELECT id, summary_text FROM chat_summary WHERE user_id = ? ORDER BY timestamp DESC LIMIT -1 OFFSET ?",
+            (user_id, int(summaries_tobesaved))
+        ).fetchall()
+
+        if not evicted_history and not evicted_summaries:
+            return
+
+        # Keep evicted summaries in long-term memory before they leave the table (oldest first)
+        if evicted_summaries:
+            add_summaries_to_vector_store(
+                new_summaries=[row[1] for row in reversed(evicted_summaries)],
+                user_id=user_id
+            )
+            # A crash after the DELETE must not lose them while the write is still debounced
+            flush_vector_store(get_store_path(user_id))
+
+        conn.executemany("DELETE FROM chat_history WHERE id = ?", [(row[0],) for row in evicted_history])
+        conn.executemany("DELETE FROM chat_summary WHERE id = ?", [(row[0],) for row in evicted_summaries])
+        conn.commit()
+    verbose(f"Compacted records for user {user_id}: removed {len(evicted_history)} chat history "
+            f"and {len(evicted_summaries)} chat summary rows")
+
+def save_chat_responses(user_message: str, bot_response: str, user_id: str) -> str:
+    """Saves a user message and bot response to the database and returns the turn's timestamp."""
     timestamp = datetime.datetime.now().isoformat()
     
-    cursor.execute(
-        "INSERT INTO chat_history (user_message, bot_response, timestamp, user_id) VALUES (?, ?, ?, ?)",
-        (user_message, bot_response, timestamp, user_id)
-    )
-    
-    conn.commit()
-    print(f"VERBOSE: Saved chat responses")
-    
-    conn.close()
+    with span("db.write", table="chat_history"), get_connection() as conn:
+        conn.execute(
+            "INSERT INTO chat_history (user_message, bot_response, timestamp, user_id) VALUES (?, ?, ?, ?)",
+            (user_message, bot_response, timestamp, user_id)
+        )
+        conn.commit()
+    verbose(f"Saved chat responses")
+    return timestamp
 
 def init_db():  
     # Connect to SQL db and create DB file if it does not exist
     if not os.path.exists("data"):
         os.makedirs("data")
-    conn = getconnobject()
-    cursor = conn.cursor()
-    
-    #Create tables in SQL DB
-    cursor.executescript("""
-                         CREATE TABLE IF NOT EXISTS chat_history (
-                             id INTEGER PRIMARY KEY AUTOINCREMENT,
-                             user_message TEXT NOT NULL,
-                             bot_response TEXT NOT NULL,
-                             timestamp TEXT NOT NULL,
-                             user_id TEXT NOT NULL
-                        );
-                             
-                        CREATE TABLE IF NOT EXISTS chat_summary (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            summary_text TEXT NOT NULL,
-                            timestamp TEXT NOT NULL,
-                            user_id TEXT NOT NULL
-                        );
-                         """)
-    
-    # Commit changes and close connection
-    conn.commit()
-    print(f"VERBOSE: Created tables if they did not exist")
-    
-    conn.close()
\ No newline at end of file
+    with get_connection() as conn:
+        #Create tables in SQL DB
+        conn.executescript("""
+                             CREATE TABLE IF NOT EXISTS chat_history (
+                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                 user_message TEXT NOT NULL,
+                                 bot_response TEXT NOT NULL,
+                                 timestamp TEXT NOT NULL,
+                                 user_id TEXT NOT NULL
+                            );
+                                 
+                            CREATE TABLE IF NOT EXISTS chat_summary (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                summary_text TEXT NOT NULL,
+                                timestamp TEXT NOT NULL,
+                                user_id TEXT NOT NULL
+                            );
+                             """)
+        
+        # Commit changes
+        conn.commit()
+        verbose(f"Created tables if they did not exist")
+
+        # Apply pending schema migrations, each in one transaction with its user_version bump.
+        # BEGIN IMMEDIATE makes processes starting at the same time take turns, and the version is
+        # read again inside the transaction so a migration another process applied is skipped
+        for number, migration in enumerate(SCHEMA_MIGRATIONS, start=1):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                    conn.rollback()
+                    continue
+                # Migrations hold no ';' inside literals, so they split into statements safely
+                for statement in migration.split(";"):
+                    if statement.strip():
+                        conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            verbose(f"Applied schema migration {number}")
@@ -0,0 +1,119 @@
+import numpy as np
+
+from utils.faiss_persistence import read_log, read_log_tail, get_log_size, append_entries
+from utils.mmap_store import top_k_by_distance, squared_l2_distances
+from utils.tracing import verbose
+
+import threading
+
+class TenantIndex:
+    """
+    One memory-resident flat index holding the vectors of every user, with a
+    user_id -> row ids postings map so a user's search only touches that user's rows.
+    Replaces one small FAISS directory per user with a single append-only log on disk
+    (the segments/docstore format of utils/faiss_persistence.py, user_id in the metadata).
+    Scores are squared L2 distances; per-user stores from before the switch are moved in on first use.
+    Entries other processes append to the log are picked up before every search.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()  # guards the in-memory rows; held by searches
+        self._write_lock = threading.Lock()  # serializes log appends, so searches never wait on their fsyncs
+        self._vectors = None  # preallocated, grown by doubling; rows [0, count) are live
+        self.count = 0
+        self.texts = []
+        self.ids = set()
+        self.postings = {}
+        self._log_end = 0  # bytes and entries of the log already read
+        self._log_entries = 0
+        self._load()
+
+    def _load(self):
+        # The log is never compacted into a snapshot, so it is always generation 0
+        entries, vectors, self._log_end = read_log(self.path, 0)
+        self._log_entries = len(entries)
+        if not entries:
+            return
+        self._append_rows(entries, vectors)
+        verbose(f"Loaded tenant index with {self.count} vectors for {len(self.postings)} users: {self.path}")
+
+    def _catch_up(self):
+        """
+        Adds the log entries written since it was last read (lock held). Entries this process
+        wrote are already in the index and are skipped by id.
+        """
+        if get_log_size(self.path, 0) == self._log_end:
+            return
+        entries, vectors, self._log_end = read_log_tail(self.path, 0, self._log_end, self._log_entries)
+        self._log_entries += len(entries)
+        new_rows = [i for i, entry in enumerate(entries) if entry["id"] not in self.ids]
+        if new_rows:
+            self._append_rows([entries[i] for i in new_rows], vectors[new_rows])
+            verbose(f"Caught up with {len(new_rows)} vectors appended by another process: {self.path}")
+
+    def _append_rows(self, entries: list, vectors: np.ndarray):
+        needed = self.count + len(entries)
+        if self._vectors is None or needed > len(self._vectors):
+            capacity = max(needed, 2 * (len(self._vectors) if self._vectors is not None else 0), 1024)
+            grown = np.empty((capacity, vectors.shape[1]), dtype=np.float32)
+            if self.count:
+                grown[:self.count] = self._vectors[:self.count]
+            self._vectors = grown
+
+        self._vectors[self.count:needed] = vectors
+        for row, entry in enumerate(entries, start=self.count):
+            self.texts.append(entry["text"])
+            self.ids.add(entry["id"])
+            self.postings.setdefault(entry["metadata"]["user_id"], []).append(row)
+        self.count = needed
+
+    def has_user(self, user_id: str) -> bool:
+        with self._lock:
+            self._catch_up()
+            return user_id in self.postings
+
+    def add(self, user_id: str, ids: list, texts: list, vectors: list):
+        """Writes the user's new vectors to the log and makes them searchable. Ids already in the index are skipped."""
+        with self._write_lock:
+            with self._lock:
+                entries = [
+                    (doc_id, text, {"user_id": user_id}, vector)
+                    for doc_id, text, vector in zip(ids, texts, vectors) if doc_id not in self.ids
+                ]
+            if not entries:
+                return
+            append_entries(self.path, entries)
+
+            # Only publishing the rows takes the index lock; a search that caught up with
+            # the log in between already added them, and they are skipped by id
+            with self._lock:
+                new_entries = [entry for entry in entries if entry[0] not in self.ids]
+                if new_entries:
+                    self._append_rows(
+                        [{"id": doc_id, "text": text, "metadata": metadata} for doc_id, text, metadata, _ in new_entries],
+                        np.asarray([vector for _, _, _, vector in new_entries], dtype=np.float32)
+                    )
+
+    def search(self, user_id: str, query_embedding: list, k: int = 4) -> list:
+        """Returns up to k (text, score) pairs from the user's rows, lower scores being closer matches."""
+        with self._lock:
+            self._catch_up()
+            rows = self.postings.get(user_id)
+            if not rows:
+                return []
+            rows = np.asarray(rows)
+            distances = squared_l2_distances(self._vectors[rows], np.asarray(query_embedding, dtype=np.float32))
+            return [(self.texts[rows[i]], float(distances[i])) for i in top_k_by_distance(distances, k)]
+
+_tenant_indexes = {}
+_tenant_indexes_lock = threading.Lock()
+
+def get_tenant_index(path: str) -> TenantIndex:
+    """Returns the process-wide tenant index stored at path, loading it on first use."""
+    with _tenant_indexes_lock:
+        index = _tenant_indexes.get(path)
+        if index is None:
+            index = TenantIndex(path)
+            _tenant_indexes[path] = index
+    return index
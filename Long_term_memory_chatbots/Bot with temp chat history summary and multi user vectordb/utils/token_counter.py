@@ -1,4 +1,17 @@
 import tiktoken
+import re
+from functools import lru_cache
+
+from utils.tracing import span, verbose
+
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# Configuration
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", 4096))
+TOKENIZER = os.getenv("TOKENIZER", "tiktoken")  # "approx" counts without downloading the tiktoken encoding (offline runs)
+DEFAULT_CONTEXT_WINDOW = int(os.getenv("DEFAULT_CONTEXT_WINDOW", 4096))  # for models missing from MODEL_CONTEXT_WINDOWS
 
 # You can add more models and their context windows here
 MODEL_CONTEXT_WINDOWS = {
@@ -6,25 +19,87 @@ MODEL_CONTEXT_WINDOWS = {
     "llama3.2:1b": 4096,  # 4k token context for 1B LLaMA3.2
 }
 
+_warned_models = set()  # unknown models already warned about, so the warning is not repeated every turn
+
 def get_model_context_window(model: str) -> int:
     """
-    Retrieve the context window (max tokens) for a model.
+    Retrieve the context window (max tokens) for a model, or DEFAULT_CONTEXT_WINDOW if it is not listed.
     """
     context_window = MODEL_CONTEXT_WINDOWS.get(model)
     if context_window is None:
-        print(f"⚠️ Context window not known for model '{model}'.")
+        if model not in _warned_models:
+            _warned_models.add(model)
+            verbose(f"⚠️ Context window not known for model '{model}', assuming {DEFAULT_CONTEXT_WINDOW} tokens.")
+        return DEFAULT_CONTEXT_WINDOW
     return context_window
 
+class _ApproxEncoder:
+    # Words and punctuation marks, within a few percent of cl100k_base counts on English chat text
+    def encode(self, text: str) -> list:
+        return re.findall(r"\w+|[^\w\s]", text)
+
+@lru_cache(maxsize=None)
+def get_encoder(encoding_name: str = "cl100k_base"):
+    """
+    Load a tiktoken encoder once per process.
+    """
+    if TOKENIZER == "approx":
+        return _ApproxEncoder()
+    return tiktoken.get_encoding(encoding_name)
+
+@lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)
+def count_text_tokens(text: str) -> int:
+    """
+    Count tokens for a single text segment, memoized for segments that repeat across turns
+    (chat turns, summaries, system prompts). Only cache misses are traced.
+    """
+    with span("tokens.count") as s:
+        tokens = len(get_encoder().encode(text))
+        s.set(counted_tokens=tokens)
+    return tokens
+
 def count_tokens(messages: list) -> int:
     """
     Count tokens for a list of messages using tiktoken.
     """
-    enc = tiktoken.get_encoding("cl100k_base")
+    enc = get_encoder()
     text = ""
     for m in messages:
         # Include role markers to mimic chat formatting
         text += f"<|{m['role']}|>\n{m['content']}\n"
-    return len(enc.encode(text))
+    with span("tokens.count", messages=len(messages)) as s:
+        tokens = len(enc.encode(text))
+        s.set(counted_tokens=tokens)
+    return tokens
+
+class TokenCounter:
+    """
+    Running token total for a prompt that is built up segment by segment.
+    Each segment is counted once (and memoized), so appending never re-tokenizes what is
+    already in the prompt. Totals can differ from count_tokens by a few tokens where
+    segments meet.
+    """
+
+    def __init__(self, model: str):
+        self.context_window = get_model_context_window(model)
+        self.used = 0
+
+    def add(self, text: str) -> int:
+        """Add a text segment and return its token count."""
+        tokens = count_text_tokens(text)
+        self.used += tokens
+        return tokens
+
+    def add_message(self, role: str, content: str) -> int:
+        """Add a chat message, including its role markers."""
+        return self.add(f"<|{role}|>\n") + self.add(content) + self.add("\n")
+
+    def reset(self):
+        self.used = 0
+
+    @property
+    def remaining(self) -> int:
+        return max(self.context_window - self.used, 0)
 
 def is_contextwindow_full(model: str, messages: list) -> dict:
     """
@@ -32,10 +107,6 @@ def is_contextwindow_full(model: str, messages: list) -> dict:
     """
     total_tokens = count_tokens(messages)
     context_window = get_model_context_window(model)
-
-    if context_window is None:
-        return {"used": total_tokens, "remaining": None, "context_window": None}
-
     remaining = max(context_window - total_tokens, 0)
     return {
         "used": total_tokens,
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import threading
+import contextvars
+from contextlib import contextmanager
+from dotenv import load_dotenv
+load_dotenv()
+
+# Configuration
+# "none", "prometheus" (in-process counters, served on GET /metrics/prometheus),
+# "jsonl" (the counters plus one line per span in TRACE_FILE) or "jsonl,prometheus"
+TRACE_EXPORTERS = {name.strip() for name in os.getenv("TRACE_EXPORTER", "none").lower().split(",")} - {"", "none"}
+TRACE_FILE = os.getenv("TRACE_FILE", "data/traces.jsonl")
+LOG_VERBOSE = os.getenv("LOG_VERBOSE", "true").lower() in ("1", "true", "yes")
+
+TRACING_ENABLED = bool(TRACE_EXPORTERS)
+
+# Per-turn tracing: spans around each pipeline stage (db.fetch, embed, vector.search, tokens.count,
+# llm.call, memory.update, ...), tagged with the id of the turn they ran in.
+# With TRACE_EXPORTER=none, span() hands back a shared no-op object and nothing is timed or recorded.
+
+# Upper bounds (seconds) of the Prometheus latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_turn_id = contextvars.ContextVar("trace_turn_id", default=None)
+
+# Aggregates per span name, for the Prometheus exporter and get_trace_metrics()
+_stats_lock = threading.Lock()
+_stats = {}
+
+# Span records for the JSONL exporter, written by a single background thread off the hot path
+_trace_queue = queue.Queue()
+_trace_writer = None
+
+def verbose(message: str):
+    """Prints a VERBOSE progress line, unless LOG_VERBOSE is off."""
+    if LOG_VERBOSE:
+        print(f"VERBOSE: {message}")
+
+class Span:
+    """Times a block; numeric attributes ending in "_tokens" are also summed per span name."""
+    __slots__ = ("name", "attributes", "turn_id", "started")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.turn_id = _turn_id.get()
+
+    def set(self, **attributes):
+        """Adds attributes known only once the work is done (result sizes, token counts)."""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _record_span(self, time.perf_counter() - self.started, exc_type)
+        return False
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+def span(name: str, **attributes):
+    """
+    Context manager timing one pipeline stage:
+        with span("vector.search", store="user") as s:
+            ...
+            s.set(results=len(results))
+    """
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+@contextmanager
+def trace_turn(user_id: str):
+    """Tags every span opened in the block (and in threads started with copy_context) with a new turn id."""
+    if not TRACING_ENABLED:
+        yield
+        return
+    token = _turn_id.set(uuid.uuid4().hex[:16])
+    try:
+        with span("turn", user_id=user_id):
+            yield
+    finally:
+        try:
+            _turn_id.reset(token)
+        except ValueError:
+            # A streaming generator closed from another context; that context never saw the id
+            pass
+
+def _record_span(span: Span, seconds: float, exc_type):
+    tokens = {
+        key: value for key, value in span.attributes.items()
+        if key.endswith("_tokens") and isinstance(value, (int, float))
+    }
+    with _stats_lock:
+        stats = _stats.get(span.name)
+        if stats is None:
+            stats = _stats[span.name] = {
+                "count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0,
+                "buckets": [0] * len(LATENCY_BUCKETS), "tokens": {}
+            }
+        stats["count"] += 1
+        stats["errors"] += exc_type is not None
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                stats["buckets"][i] += 1
+                break
+        for key, value in tokens.items():
+            stats["tokens"][key] = stats["tokens"].get(key, 0) + value
+
+    if "jsonl" in TRACE_EXPORTERS:
+        record = {
+            "ts": time.time(),
+            "span": span.name,
+            "turn_id": span.turn_id,
+            "duration_ms": round(seconds * 1000, 3),
+            **span.attributes,
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        _queue_trace_record(record)
+
+def _queue_trace_record(record: dict):
+    """Hands a span record to the JSONL writer, starting it on first use."""
+    global _trace_writer
+    if _trace_writer is None:
+        with _stats_lock:
+            if _trace_writer is None:
+                _trace_writer = threading.Thread(target=_trace_writer_loop, name="trace-writer", daemon=True)
+                _trace_writer.start()
+    _trace_queue.put(record)
+
+def _trace_writer_loop():
+    os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+    with open(TRACE_FILE, "a", encoding="utf-8") as f:
+        while True:
+            record = _trace_queue.get()
+            try:
+                f.write(json.dumps(record, default=str) + "\n")
+                if _trace_queue.empty():
+                    f.flush()
+            except Exception as e:
+                verbose(f"⚠️ Could not write trace record: {e}")
+            finally:
+                _trace_queue.task_done()
+
+def flush_traces():
+    """Blocks until every queued span record is in TRACE_FILE."""
+    if _trace_writer is not None:
+        _trace_queue.join()
+
+atexit.register(flush_traces)
+
+def get_trace_metrics() -> dict:
+    """Returns count, error count, average and max duration and token totals per span name."""
+    with _stats_lock:
+        return {
+            name: {
+                "count": stats["count"],
+                "errors": stats["errors"],
+                "avg_seconds": stats["seconds"] / stats["count"],
+                "max_seconds": stats["max_seconds"],
+                **stats["tokens"],
+            }
+            for name, stats in _stats.items()
+        }
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+def get_prometheus_metrics() -> str:
+    """Renders the span aggregates in the Prometheus text exposition format."""
+    with _stats_lock:
+        snapshot = {name: {**stats, "buckets": list(stats["buckets"]), "tokens": dict(stats["tokens"])}
+                    for name, stats in sorted(_stats.items())}
+
+    lines = [
+        "# HELP memory_bot_span_seconds Duration of traced pipeline stages.",
+        "# TYPE memory_bot_span_seconds histogram",
+    ]
+    for name, stats in snapshot.items():
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+            cumulative += count
+            lines.append(f"memory_bot_span_seconds_bucket{_labels(span=name, le=bound)} {cumulative}")
+        lines.append(f"memory_bot_span_seconds_bucket{_labels(span=name, le='+Inf')} {stats['count']}")
+        lines.append(f"memory_bot_span_seconds_sum{_labels(span=name)} {stats['seconds']}")
+        lines.append(f"memory_bot_span_seconds_count{_labels(span=name)} {stats['count']}")
+
+    lines += [
+        "# HELP memory_bot_span_errors_total Traced stages that raised an exception.",
+        "# TYPE memory_bot_span_errors_total counter",
+    ]
+    lines += [f"memory_bot_span_errors_total{_labels(span=name)} {stats['errors']}" for name, stats in snapshot.items()]
+
+    lines += [
+        "# HELP memory_bot_tokens_total Tokens counted by traced stages, by kind.",
+        "# TYPE memory_bot_tokens_total counter",
+    ]
+    for name, stats in snapshot.items():
+        for kind, total in sorted(stats["tokens"].items()):
+            lines.append(f"memory_bot_tokens_total{_labels(span=name, kind=kind.removesuffix('_tokens'))} {total}")
+
+    return "\n".join(lines) + "\n"
@@ -1,82 +1,755 @@
 from langchain_community.vectorstores import FAISS
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_ollama import OllamaEmbeddings
+import numpy as np
 
 from utils.prompt_manager import prepare_vectordb_search_prompt
+from utils.embedding_cache import CachedEmbeddings
+from utils.fake_backends import HashEmbeddings, HASH_EMBEDDING_DIM
+from utils.faiss_persistence import (load_store, append_entries, compact_store, store_exists,
+                                     read_generation, get_log_size, read_log_tail)
+from utils.mmap_store import get_mmap_store
+from utils.numpy_store import NumpyVectorStore, load_numpy_store, remove_numpy_store
+from utils.tenant_index import get_tenant_index
+from utils.ann_index import build_ann_index, set_search_params, needs_training, reconstruct_vectors
+from utils.tracing import verbose, span
 
 import os
+import time
+import shutil
+import uuid
+import queue
+import heapq
+import atexit
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+from contextlib import contextmanager
 from dotenv import load_dotenv
 load_dotenv()
 
+try:
+    import fcntl
+except ImportError:
+    # Windows: the single knowledge store writer process is not enforced
+    fcntl = None
+
 # Configuration
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL")
-ollama_embeddings = OllamaEmbeddings(model=OLLAMA_MODEL)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "ollama")  # "ollama" or "hash" (offline, see utils/fake_backends.py)
+if EMBEDDING_BACKEND == "hash":
+    ollama_embeddings = CachedEmbeddings(embeddings=HashEmbeddings(HASH_EMBEDDING_DIM), model=f"hash-{HASH_EMBEDDING_DIM}")
+else:
+    ollama_embeddings = CachedEmbeddings(
+        embeddings=OllamaEmbeddings(model=OLLAMA_MODEL),
+        model=OLLAMA_MODEL
+    )
 vectordb_path = os.getenv("VECTORDB_PATH")
+VECTORDB_CACHE_MAX_ENTRIES = int(os.getenv("VECTORDB_CACHE_MAX_ENTRIES", 64))
+VECTORDB_CACHE_MAX_MB = float(os.getenv("VECTORDB_CACHE_MAX_MB", 512))
+VECTORDB_FLUSH_DELAY_SECONDS = float(os.getenv("VECTORDB_FLUSH_DELAY_SECONDS", 5))
+USER_VECTOR_BACKEND = os.getenv("USER_VECTOR_BACKEND", "numpy")  # "numpy", "faiss" or "tenant"
+USER_NUMPY_MAX_DOCS = int(os.getenv("USER_NUMPY_MAX_DOCS", 2000))
+GENERAL_VECTOR_BACKEND = os.getenv("GENERAL_VECTOR_BACKEND", "faiss")  # "faiss" or "mmap"
+VECTORDB_COMPACT_AFTER = int(os.getenv("VECTORDB_COMPACT_AFTER", 1000))
+GENERAL_SHARD_MAX_DOCS = int(os.getenv("GENERAL_SHARD_MAX_DOCS", 5000))
+GENERAL_WRITER_BATCH_SIZE = int(os.getenv("GENERAL_WRITER_BATCH_SIZE", 32))
+GENERAL_WRITER_MAX_WAIT_SECONDS = float(os.getenv("GENERAL_WRITER_MAX_WAIT_SECONDS", 0))
 
-def get_vectordb_search_results(user_question: str, user_id: str):
+class _ReadWriteLock:
+    """Any number of searches at a time, or one in-memory change to the index (writers go first)."""
+
+    def __init__(self):
+        self._changed = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._changed:
+            while self._writing or self._writers_waiting:
+                self._changed.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._readers -= 1
+                if not self._readers:
+                    self._changed.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._changed:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._changed.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._writing = False
+                self._changed.notify_all()
+
+# Process-wide index cache (store path -> FAISS or NumpyVectorStore object), least recently used first.
+# The store lock serializes writers and their disk I/O (flush, compaction, ANN builds); searches only
+# take the index lock for reading, which writers hold just while changing the in-memory index.
+_index_cache = OrderedDict()
+_cache_lock = threading.RLock()
+_store_locks = defaultdict(threading.RLock)
+_index_locks = defaultdict(_ReadWriteLock)
+# Store path -> how the store looked on disk when the cached copy was last in sync with it:
+# (generation, log bytes, log entries) for FAISS stores, vectors.npy (mtime, size) for small ones
+_disk_states = {}
+_dirty_paths = set()
+_flush_timers = {}
+_pending_appends = defaultdict(list)  # store path -> [(id, text, metadata, vector)] not yet on disk
+
+# General knowledge store: append-only shards written by a single writer thread.
+# Queue items are (summaries, future); the future resolves once the batch is on disk.
+_general_queue = queue.Queue()
+_general_writer = None
+_general_shards = None
+_general_shards_mtime = None  # shards directory mtime when _general_shards was listed
+_general_writer_lock_file = None  # held for the life of the process once this process is the writer
+_general_writer_lock_guard = threading.Lock()
+_ann_training = set()  # general shard paths with a background ANN build running
+_tenant_checked_users = set()  # users whose pre-tenant store has been moved into the tenant index
+
+def get_store_path(user_id: str | None) -> str:
+    """Returns the on-disk path of the user store, or of the general knowledge store."""
+    if user_id:
+        return os.path.join(vectordb_path, "user", user_id)
+    return os.path.join(vectordb_path, "general", "knowledge_store")
+
+def _get_user_tenant_index():
+    """Returns the consolidated index shared by all users (USER_VECTOR_BACKEND=tenant)."""
+    return get_tenant_index(os.path.join(vectordb_path, "tenants"))
+
+def _move_user_store_to_tenant_index(user_id: str):
     """
-    Performs a similarity search in the appropriate vector database (user or general)
-    based on the provided user_id and returns only the search results text.
+    Moves a per-user store written before the switch to USER_VECTOR_BACKEND=tenant into the tenant
+    index, so all of the user's vectors are scored with one metric, then deletes it. Runs once per
+    user and process; the tenant index skips ids it already holds, so an interrupted move is redone safely.
     """
-    # === Step 1: Prepare semantic search prompt ===
-    prompt = prepare_vectordb_search_prompt(user_question)
-    embeddings = ollama_embeddings
+    if user_id in _tenant_checked_users:
+        return
+    path = get_store_path(user_id)
+    with _get_store_lock(path):
+        if user_id in _tenant_checked_users:
+            return
+        db = load_vector_store(path)
+        if db is not None:
+            if isinstance(db, NumpyVectorStore):
+                ids, texts, vectors = db.ids, db.texts, np.asarray(db.vectors)
+            else:
+                ids = [db.index_to_docstore_id[row] for row in range(db.index.ntotal)]
+                texts = [db.docstore.search(doc_id).page_content for doc_id in ids]
+                vectors = reconstruct_vectors(db.index, 0, db.index.ntotal)
+            _get_user_tenant_index().add(user_id, ids, texts, vectors)
 
-    # === Step 2: Determine database path ===
-    if user_id:
-        path = os.path.join(vectordb_path, "user", user_id)
-    else:
-        path = os.path.join(vectordb_path, "general", "knowledge_store")
+            with _cache_lock:
+                _index_cache.pop(path, None)
+                _dirty_paths.discard(path)
+                timer = _flush_timers.pop(path, None)
+            if timer:
+                timer.cancel()
+            _pending_appends.pop(path, None)
+            _disk_states.pop(path, None)
+            shutil.rmtree(path, ignore_errors=True)
+            verbose(f"Moved vector store with {len(ids)} vectors into the tenant index: {path}")
+        _tenant_checked_users.add(user_id)
+
+def _get_store_lock(path: str) -> threading.RLock:
+    with _cache_lock:
+        return _store_locks[path]
 
-    # === Step 3: Check if the database exists ===
-    if not os.path.exists(path):
+def _get_index_lock(path: str) -> _ReadWriteLock:
+    with _cache_lock:
+        return _index_locks[path]
+
+def _get_numpy_file_state(path: str) -> tuple | None:
+    try:
+        stat = os.stat(os.path.join(path, "vectors.npy"))
+    except FileNotFoundError:
         return None
+    return (stat.st_mtime_ns, stat.st_size)
 
-    # === Step 4: Load the FAISS index ===
-    vectorstore_faiss = FAISS.load_local(
-        path,
-        embeddings,
-        allow_dangerous_deserialization=True
-    )
+def _disk_changed(path: str, db) -> bool:
+    """Whether another process wrote the store since it was cached; a few stat calls, no lock."""
+    state = _disk_states.get(path)
+    if isinstance(db, NumpyVectorStore):
+        return _get_numpy_file_state(path) != state
+    if state is None:
+        return True
+    generation, log_bytes, _ = state
+    return read_generation(path) != generation or get_log_size(path, generation) != log_bytes
 
-    # === Step 5: Perform similarity search ===
-    results = vectorstore_faiss.similarity_search(prompt)
+def _replay_log_tail(path: str, db) -> bool:
+    """
+    Adds the entries appended to a cached FAISS store's log by another process (store lock held).
+    Returns False if the store was compacted meanwhile, so the cached copy has to be reloaded.
+    """
+    generation, log_bytes, log_count = _disk_states[path]
+    if read_generation(path) != generation:
+        return False
+    entries, vectors, log_end = read_log_tail(path, generation, log_bytes, log_count)
+    if entries:
+        with _get_index_lock(path).write():
+            db.add_embeddings(
+                [(entry["text"], vector.tolist()) for entry, vector in zip(entries, vectors)],
+                metadatas=[entry["metadata"] for entry in entries],
+                ids=[entry["id"] for entry in entries]
+            )
+        verbose(f"Caught up with {len(entries)} vectors appended by another process: {path}")
+    _disk_states[path] = (generation, log_end, log_count + len(entries))
+    return True
 
-    # === Step 6: Concatenate page contents ===
-    if results:
-        search_results = "\n".join(doc.page_content for doc in results)
-    else:
-        search_results = None
+def _sync_with_disk(path: str):
+    """
+    Brings the cached copy of a store up to date with writes from other processes (store lock held):
+    appended log entries are replayed onto it, anything else (a compaction, a rewritten small store)
+    reloads it. Returns the up-to-date store, or None if it no longer exists.
+    """
+    with _cache_lock:
+        db = _index_cache.get(path)
+    if db is None:
+        return _load_from_disk(path)
+    if not _disk_changed(path, db):
+        return db
+    if not isinstance(db, NumpyVectorStore) and _disk_states.get(path) is not None and _replay_log_tail(path, db):
+        return db
+    if path in _dirty_paths:
+        # Unsaved changes of this process are kept; the next flush writes them over or after the new data
+        return db
+    with _cache_lock:
+        _index_cache.pop(path, None)
+    return _load_from_disk(path)
 
-    # === Step 7: Print verbose logs ===
-    if user_id:
-        print("VERBOSE: User Vector DB search results fetched")
+def _load_from_disk(path: str):
+    """Loads a store into the cache (store lock held). Returns None if it does not exist yet."""
+    # Taken before reading, so a rewrite during the load is picked up on the next cache hit
+    numpy_state = _get_numpy_file_state(path)
+    db, log_position = load_store(path, ollama_embeddings)
+    if db is not None:
+        _disk_states[path] = log_position
     else:
-        print("VERBOSE: General Vector DB search results fetched")
+        db = load_numpy_store(path)
+        if db is None:
+            _disk_states.pop(path, None)
+            return None
+        _disk_states[path] = numpy_state
+    _cache_vector_store(path, db)
+    verbose(f"Loaded vector store into cache: {path}")
+    return db
 
-    return search_results
+def _estimate_index_mb(db) -> float:
+    if isinstance(db, NumpyVectorStore):
+        return db.vectors.nbytes / (1024 * 1024) if db.vectors is not None else 0.0
+    # Flat FAISS indexes hold ntotal float32 vectors of dimension d
+    return db.index.ntotal * db.index.d * 4 / (1024 * 1024)
 
+def _compact_store(path: str):
+    # Only the writer process rewrites knowledge store shards; other processes keep reading its log
+    if path.startswith(os.path.join(vectordb_path, "general")) and fcntl is not None and _general_writer_lock_file is None:
+        return
+    with _get_store_lock(path):
+        with _cache_lock:
+            db = _index_cache.get(path)
+        if db is None:
+            return
+        # The snapshot must hold what other processes appended, or compaction would drop it
+        if _disk_states.get(path) is not None and not _replay_log_tail(path, db):
+            return
+        # The snapshot holds every vector in memory, including ones not yet appended
+        _pending_appends.pop(path, None)
+        compact_store(path, db)
+        _disk_states[path] = (read_generation(path), 0, 0)
 
-def update_vector_store(new_summary: str, user_id: str):
-    summary_text = f"Latest chat summary-\n{new_summary}\n"
+def _flush_store(path: str):
+    """Appends a cached store's unsaved vectors to its on-disk log, compacting the log when it grows too long."""
+    with _get_store_lock(path):
+        with _cache_lock:
+            _flush_timers.pop(path, None)
+            if path not in _dirty_paths:
+                return
+            _dirty_paths.discard(path)
+        entries = _pending_appends.pop(path, None)
+        if not entries:
+            return
+        with _cache_lock:
+            db = _index_cache.get(path)
+        try:
+            if isinstance(db, NumpyVectorStore):
+                # Small stores are rewritten in full, there is no log to compact
+                db.save(path)
+                _disk_states[path] = _get_numpy_file_state(path)
+                verbose(f"Saved {len(db)} vectors to disk: {path}")
+                return
+            # Entries another process appended come first, so the log position stays exact
+            if _disk_states.get(path) is not None and not _replay_log_tail(path, db):
+                # Compacted by another process; reloaded on the next cache hit
+                _disk_states.pop(path)
+            log_entries = append_entries(path, entries)
+            if _disk_states.get(path) is not None:
+                generation, _, log_count = _disk_states[path]
+                _disk_states[path] = (generation, get_log_size(path, generation), log_count + len(entries))
+        except Exception:
+            # Drop the cached copy so memory matches disk again; the memory update job retries the whole write
+            with _cache_lock:
+                _index_cache.pop(path, None)
+            _disk_states.pop(path, None)
+            raise
+        verbose(f"Appended {len(entries)} vectors to disk: {path}")
+
+    if log_entries >= VECTORDB_COMPACT_AFTER:
+        threading.Thread(target=_compact_store, args=(path,), daemon=True).start()
+
+def _schedule_flush(path: str):
+    """Marks a store dirty and debounces its write to disk."""
+    with _cache_lock:
+        _dirty_paths.add(path)
+        if path in _flush_timers:
+            return
+        timer = threading.Timer(VECTORDB_FLUSH_DELAY_SECONDS, _flush_store, args=(path,))
+        timer.daemon = True
+        _flush_timers[path] = timer
+        timer.start()
+
+def _evict_if_needed():
+    """
+    Evicts least recently used stores until the cache fits its budget. The tenant index is not
+    counted: it can never be evicted, so charging it here would only push out the stores that can.
+    """
+    with _cache_lock:
+        # Never evict the most recently used store
+        candidates = list(_index_cache)[:-1]
+    for path in candidates:
+        with _cache_lock:
+            total_mb = sum(_estimate_index_mb(db) for db in _index_cache.values())
+            if len(_index_cache) <= VECTORDB_CACHE_MAX_ENTRIES and total_mb <= VECTORDB_CACHE_MAX_MB:
+                return
+        # Skip stores that another thread is using rather than wait on them
+        lock = _get_store_lock(path)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            # Dirty stores are written through before they leave memory
+            _flush_store(path)
+            with _cache_lock:
+                _index_cache.pop(path, None)
+                timer = _flush_timers.pop(path, None)
+            _disk_states.pop(path, None)
+            if timer:
+                timer.cancel()
+        finally:
+            lock.release()
+        verbose(f"Evicted vector store from cache: {path}")
+
+def _cache_vector_store(path: str, db):
+    with _cache_lock:
+        _index_cache[path] = db
+        _index_cache.move_to_end(path)
+    _evict_if_needed()
+
+def load_vector_store(path: str):
+    """
+    Returns the store at path (FAISS, or NumpyVectorStore for small user stores) from the
+    process-wide cache, loading it from disk on a miss. Returns None if the store does not exist yet.
+    A cached store that another process wrote to since is brought up to date first.
+    """
+    with _cache_lock:
+        db = _index_cache.get(path)
+        if db is not None:
+            _index_cache.move_to_end(path)
+    if db is not None:
+        if not _disk_changed(path, db):
+            return db
+        # While a writer of this process holds the store, serve the cached copy rather than wait on its disk I/O
+        lock = _get_store_lock(path)
+        if not lock.acquire(blocking=False):
+            return db
+        try:
+            return _sync_with_disk(path)
+        finally:
+            lock.release()
+
+    with _get_store_lock(path):
+        # Another thread may have loaded it while we waited
+        return _sync_with_disk(path)
+
+def flush_vector_store(path: str):
+    """Writes the store's unsaved vectors to disk now instead of after VECTORDB_FLUSH_DELAY_SECONDS."""
+    _flush_store(path)
+
+def flush_vector_stores():
+    """Writes every cached store with unsaved changes to disk."""
+    with _cache_lock:
+        paths = list(_dirty_paths)
+    for path in paths:
+        _flush_store(path)
+
+atexit.register(flush_vector_stores)
+
+def get_general_shard_paths() -> list:
+    """
+    Returns the paths of the general knowledge store shards, oldest first.
+    A pre-sharding general/knowledge_store, if present, is searched as the oldest (read-only) shard.
+    """
+    global _general_shards, _general_shards_mtime
+    shards_dir = os.path.join(vectordb_path, "general", "shards")
+    # Re-listed whenever a shard is created, also by the writer in another process
+    try:
+        mtime = os.stat(shards_dir).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    with _cache_lock:
+        if _general_shards is None or mtime != _general_shards_mtime:
+            names = sorted(os.listdir(shards_dir)) if mtime is not None else []
+            _general_shards = [os.path.join(shards_dir, name) for name in names]
+            _general_shards_mtime = mtime
+        shard_paths = list(_general_shards)
+
+    legacy_path = get_store_path(None)
+    return ([legacy_path] if os.path.exists(legacy_path) else []) + shard_paths
+
+def _get_active_general_shard() -> str:
+    """Returns the shard that receives appends, rolling over to a new one when it is full (writer thread only)."""
+    get_general_shard_paths()
+    with _cache_lock:
+        active_path = _general_shards[-1] if _general_shards else None
+
+    if active_path is not None:
+        db = load_vector_store(active_path)
+        if db is None or db.index.ntotal < GENERAL_SHARD_MAX_DOCS:
+            return active_path
+
+    with _cache_lock:
+        path = os.path.join(vectordb_path, "general", "shards", f"{len(_general_shards) + 1:06d}")
+        _general_shards.append(path)
+        os.makedirs(path, exist_ok=True)
+    verbose(f"Started new knowledge store shard: {path}")
+    return path
+
+def acquire_general_writer_lock():
+    """
+    Makes this process the only one writing the knowledge store, through a lock file held until it
+    exits. Raises RuntimeError while another process holds it.
+    """
+    global _general_writer_lock_file, _general_shards
+    with _general_writer_lock_guard:
+        if _general_writer_lock_file is not None or fcntl is None:
+            return
+        lock_path = os.path.join(vectordb_path, "general", "writer.lock")
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        lock_file = open(lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError(f"The knowledge store is written by another process ({lock_path})")
+        _general_writer_lock_file = lock_file
+
+    # Shards cached while another process was writing may be stale; reload them from disk
+    general_dir = os.path.join(vectordb_path, "general")
+    with _cache_lock:
+        for path in [path for path in _index_cache if path.startswith(general_dir)]:
+            _index_cache.pop(path)
+            _disk_states.pop(path, None)
+        _general_shards = None
+    verbose(f"Took the knowledge store writer lock: {lock_path}")
+
+def _general_writer_loop():
+    while True:
+        # Wait for one request, then take every request queued meanwhile (group commit), waiting up to
+        # GENERAL_WRITER_MAX_WAIT_SECONDS for more, until the batch is full
+        batch = [_general_queue.get()]
+        deadline = time.monotonic() + GENERAL_WRITER_MAX_WAIT_SECONDS
+        while sum(len(summaries) for summaries, _ in batch) < GENERAL_WRITER_BATCH_SIZE:
+            try:
+                batch.append(_general_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        summaries = [summary for batch_summaries, _ in batch for summary in batch_summaries]
+
+        error = None
+        try:
+            acquire_general_writer_lock()
+            active_path = _get_active_general_shard()
+            _add_texts_to_store(active_path, _split_summaries(summaries))
+            # Callers are only told the summaries are saved once they are on disk
+            flush_vector_store(active_path)
+            _prepare_general_index(active_path, load_vector_store(active_path))
+            verbose(f"Vector store updated for knowledge store ({len(summaries)} summaries)")
+        except Exception as e:
+            verbose(f"⚠️ Could not write {len(summaries)} summaries to the knowledge store: {e}")
+            error = e
+        finally:
+            for _, future in batch:
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+                _general_queue.task_done()
+
+def _train_general_index(path: str):
+    """Builds an ANN index for a general shard off its store lock, swaps it in and persists it."""
+    try:
+        with _get_store_lock(path):
+            with _cache_lock:
+                db = _index_cache.get(path)
+            if db is None:
+                return
+            index = db.index
+            count = index.ntotal
+            vectors = reconstruct_vectors(index, 0, count)
 
+        started = time.monotonic()
+        ann_index = build_ann_index(vectors)
+
+        with _get_store_lock(path):
+            with _cache_lock:
+                cached = _index_cache.get(path)
+            # Evicted or rebuilt while training; the next load schedules it again
+            if cached is not db or db.index is not index:
+                return
+            # Catch up with vectors appended while training; ids stay aligned with the docstore
+            ann_index.add(reconstruct_vectors(index, count, index.ntotal))
+            set_search_params(ann_index)
+            with _get_index_lock(path).write():
+                db.index = ann_index
+        verbose(f"Built {type(ann_index).__name__} over {ann_index.ntotal} vectors in {time.monotonic() - started:.2f}s: {path}")
+
+        # Persist the trained index so it is not rebuilt on the next start
+        _compact_store(path)
+    except Exception as e:
+        verbose(f"⚠️ Could not build the ANN index for {path}: {e}")
+    finally:
+        with _cache_lock:
+            _ann_training.discard(path)
+
+def _prepare_general_index(path: str, db):
+    """Applies the ANN search settings to a general shard and schedules a background (re)build when due."""
+    set_search_params(db.index)
+    if not needs_training(db.index):
+        return
+    with _cache_lock:
+        if path in _ann_training:
+            return
+        _ann_training.add(path)
+    threading.Thread(target=_train_general_index, args=(path,), name="ann-training", daemon=True).start()
+
+def _queue_general_summaries(new_summaries: list) -> Future:
+    """
+    Hands summaries to the single knowledge store writer, starting it on first use.
+    Returns a future that resolves once they are on disk, or raises the writer's error.
+    """
+    global _general_writer
+    with _cache_lock:
+        if _general_writer is None:
+            _general_writer = threading.Thread(target=_general_writer_loop, name="general-store-writer", daemon=True)
+            _general_writer.start()
+    future = Future()
+    _general_queue.put((list(new_summaries), future))
+    return future
+
+def drain_general_writer():
+    """Blocks until every queued knowledge store summary has been written."""
+    if _general_writer is not None:
+        _general_queue.join()
+
+# Registered after flush_vector_stores so it runs first at exit
+atexit.register(drain_general_writer)
+
+def embed_search_query(user_question: str) -> list:
+    """Embeds the semantic search prompt for a user question."""
+    with span("embed", texts=1):
+        return ollama_embeddings.embed_query(prepare_vectordb_search_prompt(user_question))
+
+def _get_store_searchers(user_id: str | None) -> list:
+    """
+    Returns one search function per existing store (or shard) to query for user_id.
+    Each takes (query_embedding, k) and returns [(text, score), ...].
+    With GENERAL_VECTOR_BACKEND=mmap, general shards are read through shared memory maps
+    (utils/mmap_store.py) instead of per-process FAISS copies, where their format allows it.
+    """
+    if user_id and USER_VECTOR_BACKEND == "tenant":
+        _move_user_store_to_tenant_index(user_id)
+        tenant_index = _get_user_tenant_index()
+        if not tenant_index.has_user(user_id):
+            return []
+        return [lambda query_embedding, k: tenant_index.search(user_id, query_embedding, k)]
+
+    paths = [get_store_path(user_id)] if user_id else get_general_shard_paths()
+
+    searchers = []
+    for path in paths:
+        if not user_id and GENERAL_VECTOR_BACKEND == "mmap" and store_exists(path):
+            mmap_store = get_mmap_store(path)
+            if mmap_store is not None:
+                searchers.append(mmap_store.similarity_search_with_score_by_vector)
+                continue
+
+        db = load_vector_store(path)
+        if db is not None:
+            if not user_id:
+                _prepare_general_index(path, db)
+            searchers.append(lambda query_embedding, k, path=path, db=db:
+                             _search_cached_store(path, db, query_embedding, k))
+    return searchers
+
+def _search_cached_store(path: str, db, query_embedding: list, k: int) -> list:
+    # Not the store lock: searches never wait on a flush, compaction or ANN build of the store
+    with _get_index_lock(path).read():
+        if isinstance(db, NumpyVectorStore):
+            return db.similarity_search_with_score_by_vector(query_embedding, k=k)
+        docs_and_scores = db.similarity_search_with_score_by_vector(query_embedding, k=k)
+    return [(doc.page_content, float(score)) for doc, score in docs_and_scores]
+
+def search_vector_stores(user_question: str, user_ids: list, k: int = 4, query_embedding: list | None = None) -> dict:
+    """
+    Embeds the search prompt once and runs a similarity search against every requested store.
+    user_ids holds a user id per user store, or None for the general knowledge store
+    (all of its shards are searched and merged).
+    A precomputed query_embedding (see embed_search_query) skips the embedding call.
+    Returns {user_id: [(text, score), ...]} with lower scores being closer matches,
+    or {user_id: None} for stores that do not exist yet.
+    """
+    results = {}
+    for user_id in user_ids:
+        searchers = _get_store_searchers(user_id)
+        if not searchers:
+            results[user_id] = None
+            continue
+
+        # Only embed once at least one store exists, and reuse the vector for the rest
+        if query_embedding is None:
+            query_embedding = embed_search_query(user_question)
+
+        # Search every shard and keep the overall top-k
+        with span("vector.search", store="user" if user_id else "general", shards=len(searchers)) as s:
+            texts_and_scores = []
+            for searcher in searchers:
+                texts_and_scores.extend(searcher(query_embedding, k))
+            results[user_id] = heapq.nsmallest(k, texts_and_scores, key=lambda pair: pair[1])
+            s.set(results=len(results[user_id]))
+
+        if user_id:
+            verbose("User Vector DB search results fetched")
+        else:
+            verbose(f"General Vector DB search results fetched from {len(searchers)} shard(s)")
+
+    return results
+
+def get_vectordb_search_results(user_question: str, user_id: str):
+    """
+    Performs a similarity search in the appropriate vector database (user or general)
+    based on the provided user_id and returns only the search results text.
+    """
+    results = search_vector_stores(user_question, [user_id]).get(user_id)
+
+    if results:
+        return "\n".join(text for text, _ in results)
+    return None
+
+
+def _split_summaries(new_summaries: list) -> list:
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=10000, chunk_overlap=1000)
-    new_texts = text_splitter.split_text(summary_text)
+    new_texts = []
+    for new_summary in new_summaries:
+        summary_text = f"Latest chat summary-\n{new_summary}\n"
+        new_texts.extend(text_splitter.split_text(summary_text))
+    return new_texts
+
+def _migrate_to_faiss(path: str, db: NumpyVectorStore) -> FAISS:
+    """Rebuilds a small store that outgrew USER_NUMPY_MAX_DOCS as a FAISS snapshot (store lock held)."""
+    text_embeddings = list(zip(db.texts, np.asarray(db.vectors).tolist()))
+    faiss_db = FAISS.from_embeddings(text_embeddings, ollama_embeddings, metadatas=db.metadatas, ids=db.ids)
+    # The snapshot holds every vector, including ones not yet saved
+    _pending_appends.pop(path, None)
+    with _cache_lock:
+        _dirty_paths.discard(path)
+    compact_store(path, faiss_db)
+    remove_numpy_store(path)
+    _disk_states[path] = (read_generation(path), 0, 0)
+    _cache_vector_store(path, faiss_db)
+    verbose(f"Moved vector store with {len(db)} vectors to FAISS: {path}")
+    return faiss_db
+
+def _add_texts_to_store(path: str, new_texts: list, small_store: bool = False):
+    """
+    Embeds texts and appends them to the store at path in one write.
+    With small_store, a new store starts as an exact-search NumpyVectorStore and is moved
+    to FAISS once it holds more than USER_NUMPY_MAX_DOCS vectors.
+    """
+    if not new_texts:
+        return
+
     embeddings = ollama_embeddings
-    if user_id:
-        path = vectordb_path + "user/" + user_id
-    else:
-        path = vectordb_path + "general/knowledge_store"
-    
-    if os.path.exists(path):
-        db = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
-        db.add_texts(new_texts)
-        db.save_local(path)
-    else:
-        db = FAISS.from_texts(new_texts, embeddings)
-        db.save_local(path)
-    
-    if user_id:
-        print(f"VERBOSE: Vector store updated for user: {user_id}")
-    else:
-        print(f"VERBOSE: Vector store updated for knowledge store")
\ No newline at end of file
+
+    # Embed outside the store lock so searches are not blocked on the embedding call
+    with span("embed", texts=len(new_texts)):
+        vectors = embeddings.embed_documents(new_texts)
+    text_embeddings = list(zip(new_texts, vectors))
+    ids = [str(uuid.uuid4()) for _ in new_texts]
+
+    with _get_store_lock(path):
+        db = load_vector_store(path)
+        if db is not None:
+            with _get_index_lock(path).write():
+                db.add_embeddings(text_embeddings, ids=ids)
+        elif small_store:
+            db = NumpyVectorStore()
+            db.add_embeddings(text_embeddings, ids=ids)
+            _disk_states[path] = None
+            _cache_vector_store(path, db)
+        else:
+            db = FAISS.from_embeddings(text_embeddings, embeddings, ids=ids)
+            _disk_states[path] = (read_generation(path), 0, 0)
+            _cache_vector_store(path, db)
+
+        if isinstance(db, NumpyVectorStore) and len(db) > USER_NUMPY_MAX_DOCS:
+            _migrate_to_faiss(path, db)
+            return
+        # Only the new vectors are written on flush
+        _pending_appends[path].extend(
+            (doc_id, text, {}, vector) for doc_id, text, vector in zip(ids, new_texts, vectors)
+        )
+        _schedule_flush(path)
+
+def add_summaries_to_vector_store(new_summaries: list, user_id: str):
+    """
+    Appends a batch of chat summaries to the user vector store in one write.
+    Summaries for the general knowledge store (user_id None) are queued for its single
+    writer, which batches them into the active shard; this waits until they are on disk and
+    raises if the write failed, so the memory update job is retried. With USER_VECTOR_BACKEND=tenant,
+    user summaries go to the index shared by all users instead of a per-user store.
+    """
+    if not user_id:
+        if new_summaries:
+            _queue_general_summaries(new_summaries).result()
+        return
+
+    if USER_VECTOR_BACKEND == "tenant":
+        new_texts = _split_summaries(new_summaries)
+        if not new_texts:
+            return
+        _move_user_store_to_tenant_index(user_id)
+        with span("embed", texts=len(new_texts)):
+            vectors = ollama_embeddings.embed_documents(new_texts)
+        _get_user_tenant_index().add(user_id, [str(uuid.uuid4()) for _ in new_texts], new_texts, vectors)
+        verbose(f"Vector store updated for user: {user_id}")
+        return
+
+    _add_texts_to_store(
+        get_store_path(user_id),
+        _split_summaries(new_summaries),
+        small_store=USER_VECTOR_BACKEND == "numpy"
+    )
+    verbose(f"Vector store updated for user: {user_id}")
+
+def update_vector_store(new_summary: str, user_id: str):
+    add_summaries_to_vector_store([new_summary], user_id)